@@ -1,22 +1,20 @@
 import streamlit as st
-from PIL import Image
-import pytesseract
-import re
-import tempfile
-import os
-import sys
-
-# Optional NLP / fallback libraries
-try:
-    import fitz  # PyMuPDF
-    import dateutil.parser
-    from thefuzz import fuzz
-except ImportError:
-    pass
-
-import cv2
-import numpy as np
+import io
+import csv
 import json
+import os
+import uuid
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from invoice_ocr import ocr_document, extract_fields
+from invoice_ocr.line_items import extract_line_items
+from invoice_ocr.pipeline import init_worker, process_document
+
+PREVIEW_MAX_SIDE = 900
+# Raw OCR dumps for debugging, off unless this names a folder (one subfolder per session)
+DEBUG_DUMP_DIR = os.environ.get("INVOICE_OCR_DEBUG_DIR")
 
 # ==========================================
 # PAGE CONFIGURATION (MUST BE FIRST)
@@ -136,290 +134,183 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ==========================================
-# OCR & PREPROCESSING LOGIC
+# OCR & EXTRACTION (see the invoice_ocr package)
 # ==========================================
+def content_key(file_bytes):
+    """Cheap content hash; the cache is keyed by this instead of hashing the bytes argument."""
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+
+# The leading underscore keeps Streamlit from hashing the (large) bytes argument
+@st.cache_data(max_entries=64, show_spinner=False)
+def run_ocr(doc_key, is_pdf, _image_bytes):
+    text, preview_image, page_sources, page_words = ocr_document(_image_bytes, is_pdf=is_pdf)
+    if preview_image is not None:
+        # Only a thumbnail is kept in the cache and sent to the browser
+        preview_image = preview_image.copy()
+        preview_image.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+    # The word boxes are only needed for the table; just the items are cached
+    return text, preview_image, page_sources, extract_line_items(page_words)
+
+
+@st.cache_resource
+def debug_writer():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-debug-dump")
+
+
+def write_debug_dump(session_id, doc_key, text):
+    folder = Path(DEBUG_DUMP_DIR) / session_id
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / f"{doc_key}.txt").write_text(text, encoding="utf-8")
+
+
+def analyse(file_bytes, is_pdf):
+    """OCR + extraction for one upload, kept in the session so widget reruns reuse it."""
+    doc_key = content_key(file_bytes)
+    result = st.session_state.get("result")
+    if result is not None and result["key"] == doc_key:
+        return result
+
+    extracted_text, preview_image, page_sources, line_items = run_ocr(doc_key, is_pdf, file_bytes)
+    result = {
+        "key": doc_key,
+        "text": extracted_text,
+        "preview": preview_image,
+        "page_sources": page_sources,
+        "line_items": line_items,
+        "fields": None,
+        "json": None,
+    }
+    if extracted_text and len(extracted_text.strip()) >= 10:
+        result["fields"] = extract_fields(extracted_text)
+        result["json"] = json.dumps({**result["fields"], "Line Items": line_items}, indent=4)
+        if DEBUG_DUMP_DIR:
+            # Raw text for analysis later, written off the UI thread
+            session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+            debug_writer().submit(write_debug_dump, session_id, doc_key, extracted_text)
+    st.session_state["result"] = result
+    return result
 
-from pathlib import Path
-tess_path = Path(r"C:\Program Files\Tesseract-OCR\tesseract.exe")
-if tess_path.exists():
-    pytesseract.pytesseract.tesseract_cmd = str(tess_path)
-
-@st.cache_data
-def preprocess_image_for_ocr(image_bytes, is_pdf=False, pdf_dpi=300):
-    text = ""
-    images_pil = []
-    
-    try:
-        if is_pdf:
-            doc = fitz.open("pdf", image_bytes)
-            import io
-            for page in doc:
-                pix = page.get_pixmap(dpi=pdf_dpi)
-                img_data = pix.tobytes("png")
-                pil_img = Image.open(io.BytesIO(img_data)).convert("RGB")
-                images_pil.append(pil_img)
-        else:
-            import io
-            images_pil = [Image.open(io.BytesIO(image_bytes)).convert("RGB")]
-            
-        for idx, pil_img in enumerate(images_pil):
-            cv_img = np.array(pil_img)
-            gray = cv2.cvtColor(cv_img, cv2.COLOR_RGB2GRAY)
-            
-            h, w = gray.shape
-            if max(h, w) < 2000:
-                scale_factor = 2
-                gray = cv2.resize(gray, (w * scale_factor, h * scale_factor), interpolation=cv2.INTER_CUBIC)
-            
-            gray_blur = cv2.medianBlur(gray, 3)
-            thresh = cv2.adaptiveThreshold(
-                gray_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                cv2.THRESH_BINARY, 31, 2
-            )
-            
-            processed_pil = Image.fromarray(thresh)
-            page_text = pytesseract.image_to_string(processed_pil, config="--oem 3 --psm 6")
-            text += page_text + "\n\n"
-            
-        return text, images_pil[0] if len(images_pil) > 0 else None
-        
-    except Exception as e:
-        print("Preprocessing Error:", e)
-        return "", None
 
 # ==========================================
-# ROBUST HYBRID EXTRACTION ENGINE
+# MULTI-FILE JOBS
 # ==========================================
-def extract_fields(text):
-    data = {
-        "Invoice Number": "Not found",
-        "Order ID": "Not found",
-        "Vendor Name": "Not found",
-        "Invoice Date": "Not found",
-        "Order Date": "Not found",
-        "Due Date": "Not found",
-        "Total Amount": "Not found"
-    }
-    
-    if not text.strip():
-        return data
-
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    full_text = " ".join(lines)
-
-    # 1. VENDOR NAME EXTRACTION
-    vendor_found = False
-    for i, ln in enumerate(lines):
-        # Look for Amazon/Zomato specific markers like "Sold By:"
-        if "Sold By:" in ln or "Sold by:" in ln:
-            if i + 1 < len(lines):
-                v_line = lines[i+1]
-                # Vendors are often separated by large whitespace from user address on same line
-                parts = re.split(r'\s{2,}', v_line)
-                data["Vendor Name"] = parts[0].strip()
-                vendor_found = True
-                break
-
-    if not vendor_found:
-        # Fallback: Find the first clean ALL CAPS line that isn't a standard document string
-        for ln in lines[:10]:
-            clean_ln = re.sub(r'^[^\w]+', '', ln).strip()
-            if len(clean_ln) > 4 and clean_ln.isupper() and "INVOICE" not in clean_ln and "ORIGINAL" not in clean_ln:
-                data["Vendor Name"] = clean_ln
-                vendor_found = True
-                break
-
-    # 2. INVOICE NUMBER EXTRACTION
-    # Handles "Invoice Number :AMD2-9374"
-    inv_match = re.search(r'(?i)Invoice\s+(?:Number|No|Details)\s*[:-]?\s*([A-Za-z0-9\-_]+)', text)
-    if inv_match:
-        data["Invoice Number"] = inv_match.group(1).upper()
-        
-    # Check standard Order Number/ID (also catches garbled OCR like "Order td:" for "Order Id:")
-    ord_match = re.search(r'(?i)Order\s+(?:Number|No|ID?|td)\s*[:\-]?\s*([A-Za-z0-9\-_]+)', text)
-    if ord_match:
-        data["Order ID"] = ord_match.group(1).upper()
-
-    # 3. DATE EXTRACTION
-    # Handles DD.MM.YYYY, YYYY.MM.DD, DD-MMM-YYYY, DD MMM YYYY etc.
-    date_pattern = r'(?i)(?:Invoice|Bill|Document)?\s*Date\s*[:-]?\s*(\d{1,4}[\.\/\s-]+[A-Za-z0-9]{2,10}[\.\/\s-]+\d{1,4})'
-    date_match = re.search(date_pattern, text)
-    if date_match:
-        raw_date = date_match.group(1).strip()
-        try:
-            import dateutil.parser
-            parsed_dt = dateutil.parser.parse(raw_date, fuzzy=True)
-            data["Invoice Date"] = parsed_dt.strftime("%Y-%m-%d")
-        except:
-            data["Invoice Date"] = raw_date
-            
-    # Order Date
-    ord_date_pattern = r'(?i)Order\s*Date\s*[:-]?\s*(\d{1,4}[\.\/\s-]+[A-Za-z0-9]{2,10}[\.\/\s-]+\d{1,4})'
-    ord_date_match = re.search(ord_date_pattern, text)
-    if ord_date_match:
-        raw_ord_date = ord_date_match.group(1).strip()
-        try:
-            import dateutil.parser
-            parsed_ord_dt = dateutil.parser.parse(raw_ord_date, fuzzy=True)
-            data["Order Date"] = parsed_ord_dt.strftime("%Y-%m-%d")
-        except:
-            data["Order Date"] = raw_ord_date
-            
-    # Fallback date extraction using fuzzy approach
-    if data["Invoice Date"] == "Not found":
-        import dateutil.parser
-        for ln in lines:
-            if "date" in ln.lower():
-                try:
-                    dt = dateutil.parser.parse(ln, fuzzy=True)
-                    if 2000 <= dt.year <= 2050:
-                        data["Invoice Date"] = dt.strftime("%Y-%m-%d")
-                        break
-                except:
-                    pass
-
-    due_pattern = r'(?i)(?:Due|Pay By)\s*Date\s*[:-]?\s*(\d{1,4}[\.\/\s-]+[A-Za-z0-9]{2,10}[\.\/\s-]+\d{1,4})'
-    due_date_match = re.search(due_pattern, text)
-    if due_date_match:
-        raw_due_date = due_date_match.group(1).strip()
+BATCH_COLUMNS = ["Vendor Name", "Invoice Number", "Invoice Date", "Due Date", "Order ID", "Total Amount"]
+
+
+@st.cache_resource
+def job_pool():
+    # Shared by every session; each worker process loads its OCR engine once
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, initializer=init_worker)
+
+
+def sync_jobs(uploaded_files):
+    """Queue a background job for every new upload and drop jobs for removed ones.
+
+    Jobs are keyed by (file name, content hash), so identical files under
+    different names each get a row; they share a single OCR run.
+    """
+    jobs = st.session_state.setdefault("jobs", {})
+    futures = {doc_key: job["future"] for (_, doc_key), job in jobs.items()}
+    current = {}
+    for f in uploaded_files:
+        file_bytes = f.getvalue()
+        key = (f.name, content_key(file_bytes))
+        job = jobs.get(key)
+        if job is None:
+            fut = futures.get(key[1])
+            if fut is None:
+                fut = futures[key[1]] = job_pool().submit(process_document, file_bytes, f.name.lower().endswith(".pdf"))
+            job = {"name": f.name, "future": fut, "fields": None, "line_items": [], "error": None}
+        current[key] = job
+    in_use = {id(job["future"]) for job in current.values()}
+    for job in jobs.values():
+        if id(job["future"]) not in in_use:
+            job["future"].cancel()
+    st.session_state["jobs"] = current
+
+
+def job_status(job):
+    fut = job["future"]
+    if job["fields"] is None and job["error"] is None and fut.done():
         try:
-            import dateutil.parser
-            parsed_due = dateutil.parser.parse(raw_due_date, fuzzy=True)
-            data["Due Date"] = parsed_due.strftime("%Y-%m-%d")
-        except:
-            data["Due Date"] = raw_due_date
-
-    # 4. TOTAL AMOUNT EXTRACTION
-    # KEY INSIGHT from real OCR analysis:
-    # - Zomato: "IGST@ 38.00%" → 38.00 is a TAX RATE %, NOT an amount. Must be excluded.
-    # - Zomato: "Total Amount: Indian Rupee One And Zero Paisa only" → real total from words
-    # - Amazon: "Amount in Words: Two Hundred Sixty-four Point One only" → 264.10
-    # - Tesseract reads ₹ as % on some fonts — both treated as currency prefix
-
-    # Helper: Indian currency word-to-number parser
-    def parse_indian_rupee_words(sentence):
-        """Parse 'Indian Rupee X And Y Paisa only' style strings."""
-        word_map = {
-            "zero":0,"one":1,"two":2,"three":3,"four":4,"five":5,
-            "six":6,"seven":7,"eight":8,"nine":9,"ten":10,
-            "eleven":11,"twelve":12,"thirteen":13,"fourteen":14,"fifteen":15,
-            "sixteen":16,"seventeen":17,"eighteen":18,"nineteen":19,
-            "twenty":20,"thirty":30,"forty":40,"fifty":50,
-            "sixty":60,"seventy":70,"eighty":80,"ninety":90,
-            "hundred":100,"thousand":1000,"lakh":100000,
-        }
-        s = sentence.lower()
-        # Normalize hyphens in compound numbers: "sixty-four" → "sixty four"
-        s = re.sub(r'(\w)-(\w)', r'\1 \2', s)
-        # Split on 'and ... paisa' to separate rupees from paisa
-        paisa_val = 0
-        paisa_m = re.search(r'and\s+(\w+)\s+paisa', s)
-        if paisa_m:
-            paisa_val = word_map.get(paisa_m.group(1), 0)
-            s = s[:paisa_m.start()]  # keep only rupee part
-
-        # Remove filler words
-        for filler in ["indian", "rupee", "rupees", "only", "and"]:
-            s = s.replace(filler, " ")
-
-        # Point / decimal handling: "sixty four point one" → 64.1
-        point_val = 0
-        point_m = re.search(r'point\s+(\w+)', s)
-        if point_m:
-            point_val = word_map.get(point_m.group(1), 0) / 10.0
-            s = s[:point_m.start()]
-
-        # Sum tokens left-to-right (simple accumulator for < 10 lakh amounts)
-        tokens = [t.strip() for t in s.split() if t.strip() in word_map]
-        total = 0
-        current = 0
-        for token in tokens:
-            v = word_map[token]
-            if v == 100:
-                current = (current or 1) * 100
-            elif v >= 1000:
-                total += (current or 1) * v
-                current = 0
-            else:
-                current += v
-        total += current
-        result = total + point_val + paisa_val / 100.0
-        return result if result > 0 else None
-
-    # Step 1: Parse "Total Amount:" or "Amount in Words" text lines
-    aiw_val = None
-    for i, ln in enumerate(lines):
-        ll = ln.lower()
-        # Zomato style: "Total Amount: Indian Rupee One And Zero Paisa only"
-        if re.search(r'total\s+amount\s*:', ll):
-            after = ln.split(':', 1)[-1].strip()
-            # Try to parse the words after the colon
-            parsed = parse_indian_rupee_words(after)
-            if parsed is not None:
-                aiw_val = parsed
-                break
-        # Amazon style: "Amount in Words:" followed by words on next line
-        if "amount in words" in ll:
-            words_src = ln
-            if ':' in ln:
-                words_src = ln.split(':', 1)[-1].strip()
-            if len(words_src) < 5 and i+1 < len(lines):
-                words_src = lines[i+1]
-            parsed = parse_indian_rupee_words(words_src)
-            if parsed is not None:
-                aiw_val = parsed
-                break
-
-    # Step 2: Collect currency-prefixed numbers, EXCLUDING tax rates (number followed by %)
-    all_currency_vals = []
-    for ln in lines:
-        # Find all numbers – then discard those immediately followed by %  (= tax rate)
-        # Negative lookahead: (?!\s*%) ensures we skip "38.00%"
-        hits = re.findall(
-            r'(?:[₹\$€£]|Rs\.?\s*|INR\s*)\s*(\d{1,8}(?:\.\d{1,2})?)(?!\s*%)',
-            ln, re.IGNORECASE
-        )
-        for h in hits:
-            try:
-                v = float(h.replace(',', ''))
-                if 0 < v < 200000:
-                    all_currency_vals.append(v)
-            except: pass
-
-        # Bare decimals in table rows — only if NOT followed by %
-        if '|' in ln:
-            bare_hits = re.finditer(r'\b(\d{1,6}\.\d{2})\b(?!\s*%)', ln)
-            for bh in bare_hits:
-                try:
-                    v = float(bh.group(1))
-                    if 0 < v < 200000:
-                        all_currency_vals.append(v)
-                except: pass
-
-    # Step 3: Pick the total
-    # Priority: words-parsed value > max of currency-prefixed values
-    if aiw_val is not None:
-        total_val = aiw_val
-    elif all_currency_vals:
-        total_val = max(all_currency_vals)
+            fields, _, _, job["line_items"] = fut.result()
+            job["fields"] = fields
+        except Exception as e:
+            job["error"] = str(e) or type(e).__name__
+    if job["fields"] is not None:
+        return "✅ Done"
+    if job["error"] is not None:
+        return "❌ Failed"
+    return "⚙️ Processing" if fut.running() else "⏳ Queued"
+
+
+def job_rows(jobs):
+    rows = []
+    for job in jobs.values():
+        row = {"File": job["name"], "Status": job_status(job)}
+        fields = job["fields"] or {}
+        for col in BATCH_COLUMNS:
+            value = fields.get(col, "")
+            row[col] = "" if value == "Not found" else value
+        rows.append(row)
+    return rows
+
+
+def rows_to_csv(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def job_finished(job):
+    return job_status(job) in ("✅ Done", "❌ Failed")
+
+
+def render_jobs():
+    """Progress, results table and downloads; polls only while some job is still running."""
+    jobs = st.session_state.get("jobs", {})
+    if not jobs:
+        return
+    if all(job_finished(job) for job in jobs.values()):
+        show_jobs(jobs)
     else:
-        total_val = None
-
-    if total_val is not None:
-        data["Total Amount"] = f"₹ {total_val:.2f}"
-
-    # CROSS-POPULATION: Fill empty cards from alternate labels
-    if data["Order ID"] == "Not found" and data["Invoice Number"] != "Not found":
-        data["Order ID"] = data["Invoice Number"]
-    elif data["Invoice Number"] == "Not found" and data["Order ID"] != "Not found":
-        data["Invoice Number"] = data["Order ID"]
-
-    if data["Order Date"] == "Not found" and data["Invoice Date"] != "Not found":
-        data["Order Date"] = data["Invoice Date"]
-    elif data["Invoice Date"] == "Not found" and data["Order Date"] != "Not found":
-        data["Invoice Date"] = data["Order Date"]
-
-    return data
+        poll_jobs()
+
+
+@st.fragment(run_every=1.0)
+def poll_jobs():
+    jobs = st.session_state.get("jobs", {})
+    show_jobs(jobs)
+    if all(job_finished(job) for job in jobs.values()):
+        # One last full rerun renders the finished batch without the timer
+        st.rerun()
+
+
+def show_jobs(jobs):
+    rows = job_rows(jobs)
+    finished = sum(1 for job in jobs.values() if job["fields"] is not None or job["error"] is not None)
+    st.progress(finished / len(jobs), text=f"{finished} of {len(jobs)} invoices processed")
+    # Click a column header to sort
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    if finished == len(jobs):
+        results = [
+            {"file": job["name"], **({**job["fields"], "Line Items": job["line_items"]} if job["fields"] else {"error": job["error"]})}
+            for job in jobs.values()
+        ]
+        dl1, dl2 = st.columns(2)
+        with dl1:
+            st.download_button("📥 Download CSV", rows_to_csv(rows), file_name="invoices.csv", mime="text/csv")
+        with dl2:
+            st.download_button(
+                "📥 Download JSONL",
+                "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results),
+                file_name="invoices.jsonl",
+                mime="application/x-ndjson",
+            )
 
 
 # ==========================================
@@ -432,33 +323,34 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-uploaded_file = st.file_uploader(
+uploaded_files = st.file_uploader(
     "Upload highly-legible invoice or receipt scans",
-    type=["jpg", "jpeg", "png", "webp", "pdf"]
+    type=["jpg", "jpeg", "png", "webp", "pdf"],
+    accept_multiple_files=True,
 )
+# One file gets the detailed view; several are processed in the background as a batch
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+
+if len(uploaded_files) > 1:
+    sync_jobs(uploaded_files)
+    render_jobs()
 
 if uploaded_file:
-    file_bytes = uploaded_file.read()
+    file_bytes = uploaded_file.getvalue()
     file_extension = uploaded_file.name.split('.')[-1].lower()
     is_pdf = file_extension == "pdf"
     
     col1, col2 = st.columns([1, 1.2], gap="large")
     
     with st.spinner("Analyzing document structure..."):
-        extracted_text, preview_image = preprocess_image_for_ocr(file_bytes, is_pdf=is_pdf)
-        
-        # [SILENT DEBUG LOGGER] Write the raw text for analysis later
-        try:
-            with open('ocr_dump_debug.txt', 'w', encoding='utf-8') as f:
-                f.write(extracted_text)
-        except:
-            pass
-            
-        if not extracted_text or len(extracted_text.strip()) < 10:
+        result = analyse(file_bytes, is_pdf)
+        extracted_text, preview_image, page_sources = result["text"], result["preview"], result["page_sources"]
+
+        if result["fields"] is None:
              st.error("❌ Content Extraction Failed: The uploaded document appears to be empty or unreadable.")
              st.stop()
              
-        extracted_data = extract_fields(extracted_text)
+        extracted_data = result["fields"]
         
     with col1:
         st.markdown("<h3 style='color: #8b949e; font-size: 1.1rem; margin-bottom: 20px; letter-spacing: 1px;'>DOCUMENT PREVIEW</h3>", unsafe_allow_html=True)
@@ -531,14 +423,22 @@ if uploaded_file:
             </div>
             """, unsafe_allow_html=True)
             
+        if result["line_items"]:
+            st.markdown("<h3 style='color: #8b949e; font-size: 1.1rem; margin: 20px 0; letter-spacing: 1px;'>LINE ITEMS</h3>", unsafe_allow_html=True)
+            st.dataframe(result["line_items"], use_container_width=True, hide_index=True)
+
         st.markdown("<br/>", unsafe_allow_html=True)
         with st.expander("Show Raw OCR Output & Download JSON"):
             st.text_area("Processed Text", extracted_text, height=200)
+            st.caption("Page sources: " + ", ".join(
+                f"{page_sources.count(src)} {label}" for src, label in
+                (("text", "from PDF text layer"), ("ocr", "OCR'd"))
+                if src in page_sources
+            ))
             
-            json_output = json.dumps(extracted_data, indent=4)
             st.download_button(
                 label="📥 Download JSON Result",
-                data=json_output,
+                data=result["json"],
                 file_name=f"extraction_{extracted_data.get('Invoice Number', 'Unknown')}.json",
                 mime="application/json",
             )
@@ -0,0 +1,333 @@
+"""Offline throughput benchmark for the OCR + extraction pipeline.
+
+Synthetic Amazon-style, Zomato-style and plain-$ invoices are drawn with PIL at
+several page widths and page counts, then pushed through each pipeline stage
+separately (render, preprocess, Tesseract, extract_fields). The JSON report
+(pages/sec, p50/p95 per stage, peak RSS, field accuracy) is meant to be saved
+per commit and diffed:
+
+    python benchmark.py --docs 5 --output bench_before.json
+"""
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+from PIL import Image, ImageDraw, ImageFont
+
+from invoice_ocr.engine import get_engine
+from invoice_ocr.extract import extract_fields
+from invoice_ocr.preprocess import OCR_CONFIG, decode_image, pixmap_to_gray, preprocess_page, render_pdf_page
+
+A4_ASPECT = 1.414
+PDF_DPI = 300
+
+ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+        "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen",
+        "eighteen", "nineteen"]
+TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+ITEMS = ["USB-C Cable", "Wireless Mouse", "Paneer Tikka", "Butter Naan", "Printer Paper",
+         "Desk Lamp", "Veg Biryani", "HDMI Adapter", "Notebook A5", "Masala Dosa"]
+VENDORS = ["CLOUDTAIL INDIA PRIVATE LIMITED", "APPARIO RETAIL PRIVATE LTD", "ACME SUPPLIES",
+           "NORTHWIND TRADERS", "GLOBEX CORPORATION"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+# ==========================================
+# SYNTHETIC INVOICES
+# ==========================================
+def number_to_words(n):
+    """Spell out 0 <= n < 1 crore the way Indian invoices do (lakh/thousand/hundred)."""
+    if n < 20:
+        return ONES[n]
+    if n < 100:
+        return TENS[n // 10] + ("-" + ONES[n % 10] if n % 10 else "")
+    for unit, name in ((100000, "lakh"), (1000, "thousand"), (100, "hundred")):
+        if n >= unit:
+            rest = n % unit
+            return number_to_words(n // unit) + " " + name + (" " + number_to_words(rest) if rest else "")
+
+
+def line_items(rng, count):
+    rows = []
+    for _ in range(count):
+        qty = rng.randint(1, 4)
+        price = rng.randint(50, 900)
+        rows.append((rng.choice(ITEMS), qty, price, qty * price))
+    return rows
+
+
+def amazon_invoice(rng, item_count):
+    rows = line_items(rng, item_count)
+    total = sum(r[3] for r in rows)
+    inv_no = f"AMD{rng.randint(1, 9)}-{rng.randint(1000, 9999)}"
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    vendor = rng.choice(VENDORS[:2])
+    lines = [
+        "Tax Invoice/Bill of Supply/Cash Memo",
+        "(Original for Recipient)",
+        "Sold By:",
+        f"{vendor}      Billing Address:",
+        f"Order Number: 402-{rng.randint(1000000, 9999999)}-{rng.randint(1000000, 9999999)}",
+        f"Invoice Number : {inv_no}",
+        f"Invoice Date : {day:02d}.{month:02d}.2024",
+        "Sl | Description | Unit Price | Qty | Amount",
+    ]
+    lines += [f"{i + 1} | {d} | {p}.00 | {q} | {a}.00" for i, (d, q, p, a) in enumerate(rows)]
+    lines += [
+        f"TOTAL: | Rs. {total}.00",
+        "Amount in Words:",
+        number_to_words(total).capitalize() + " only",
+    ]
+    expected = {
+        "Invoice Number": inv_no,
+        "Invoice Date": f"2024-{month:02d}-{day:02d}",
+        "Vendor Name": vendor,
+        "Total Amount": f"₹ {total:.2f}",
+    }
+    return lines, expected
+
+
+def zomato_invoice(rng, item_count):
+    rows = line_items(rng, item_count)
+    subtotal = sum(r[3] for r in rows)
+    paisa = rng.randint(1, 99)
+    order_id = str(rng.randint(1000000000, 9999999999))
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    lines = [
+        "ZOMATO LIMITED",
+        "TAX INVOICE",
+        f"Order ID: {order_id}",
+        f"Invoice Date: {day:02d} {MONTHS[month - 1]} 2023",
+        "Item | Qty | Price",
+    ]
+    lines += [f"{d} | {q} | {a}.00" for d, q, _, a in rows]
+    lines += [
+        "IGST@ 18.00%",
+        f"Total Amount: Indian Rupee {number_to_words(subtotal).title()} And "
+        f"{number_to_words(paisa).title()} Paisa only",
+    ]
+    expected = {
+        "Invoice Number": order_id,
+        "Invoice Date": f"2023-{month:02d}-{day:02d}",
+        "Vendor Name": "ZOMATO LIMITED",
+        "Total Amount": f"₹ {subtotal + paisa / 100:.2f}",
+    }
+    return lines, expected
+
+
+def plain_invoice(rng, item_count):
+    rows = line_items(rng, item_count)
+    subtotal = sum(r[3] for r in rows)
+    tax = round(subtotal * 0.08, 2)
+    inv_no = str(rng.randint(1000, 99999))
+    day, month = rng.randint(1, 28), rng.randint(1, 11)
+    vendor = rng.choice(VENDORS[2:])
+    lines = [
+        vendor,
+        "INVOICE",
+        f"Invoice No: {inv_no}",
+        f"Invoice Date: 2024-{month:02d}-{day:02d}",
+        f"Due Date: 2024-{month + 1:02d}-{day:02d}",
+    ]
+    lines += [f"{d} x{q}      ${a:.2f}" for d, q, _, a in rows]
+    lines += [f"Subtotal ${subtotal:.2f}", f"Tax ${tax:.2f}", f"Total ${subtotal + tax:.2f}"]
+    expected = {
+        "Invoice Number": inv_no,
+        "Invoice Date": f"2024-{month:02d}-{day:02d}",
+        "Due Date": f"2024-{month + 1:02d}-{day:02d}",
+        "Vendor Name": vendor,
+        "Total Amount": f"₹ {subtotal + tax:.2f}",
+    }
+    return lines, expected
+
+
+STYLES = {"amazon": amazon_invoice, "zomato": zomato_invoice, "plain": plain_invoice}
+
+
+def load_font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def draw_page(lines, width):
+    height = int(width * A4_ASPECT)
+    # Roughly 11pt text on an A4 page, whatever the pixel width
+    font_size = max(8, width // 55)
+    font = load_font(font_size)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    margin = width // 14
+    y = margin
+    for ln in lines:
+        draw.text((margin, y), ln, fill="black", font=font)
+        y += int(font_size * 1.6)
+    return img
+
+
+def make_document(style, pages, width, seed):
+    """Return (file bytes, is_pdf, expected fields); multi-page documents become image-only PDFs."""
+    per_page = max(1, (int(width * A4_ASPECT) - 2 * (width // 14)) // int(max(8, width // 55) * 1.6))
+    # Header and totals lines around the items, from a one-item invoice of the same style
+    overhead = len(STYLES[style](random.Random(seed), item_count=1)[0]) - 1
+    # Full pages, then a last page as long as a 6-item single-page invoice
+    item_count = max(1, per_page * (pages - 1) + min(per_page, overhead + 6) - overhead)
+    lines, expected = STYLES[style](random.Random(seed), item_count=item_count)
+    chunks = [lines[i:i + per_page] for i in range(0, len(lines), per_page)][:pages]
+    chunks += [[]] * (pages - len(chunks))
+    images = [draw_page(chunk, width) for chunk in chunks]
+
+    buf = io.BytesIO()
+    if len(images) == 1:
+        images[0].save(buf, format="PNG")
+        return buf.getvalue(), False, expected
+    images[0].save(buf, format="PDF", save_all=True, append_images=images[1:], resolution=PDF_DPI)
+    return buf.getvalue(), True, expected
+
+
+# ==========================================
+# MEASUREMENT
+# ==========================================
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def decode_pages(file_bytes, is_pdf):
+    if not is_pdf:
+        yield decode_image(file_bytes)[1]
+        return
+    import fitz  # PyMuPDF
+
+    doc = fitz.open("pdf", file_bytes)
+    for page in doc:
+        pix = render_pdf_page(page, PDF_DPI)
+        # ``pix`` stays referenced by this frame until the caller asks for the next page
+        yield pixmap_to_gray(pix)
+
+
+def run_document(file_bytes, is_pdf, timings, run_ocr=True):
+    """Time every stage of one document, appending per-page/per-document samples to ``timings``."""
+    engine = get_engine() if run_ocr else None
+    texts = []
+    page_count = 0
+    pages = decode_pages(file_bytes, is_pdf)
+    while True:
+        t0 = time.perf_counter()
+        img = next(pages, None)
+        if img is None:
+            break
+        page_count += 1
+        t1 = time.perf_counter()
+        thresh = preprocess_page(img)
+        t2 = time.perf_counter()
+        timings["render"].append(t1 - t0)
+        timings["preprocess"].append(t2 - t1)
+        if run_ocr:
+            texts.append(engine.image_to_string(thresh, config=OCR_CONFIG))
+            timings["ocr"].append(time.perf_counter() - t2)
+    t3 = time.perf_counter()
+    fields = extract_fields("".join(t + "\n\n" for t in texts))
+    timings["extract"].append(time.perf_counter() - t3)
+    return page_count, fields
+
+
+def field_accuracy(fields, expected):
+    hits = sum(1 for k, v in expected.items() if fields.get(k, "").upper() == v.upper())
+    return hits, len(expected)
+
+
+def run_benchmark(styles, widths, page_counts, docs, seed=0, run_ocr=True):
+    runs = []
+    for style in styles:
+        for width in widths:
+            for pages in page_counts:
+                timings = {"render": [], "preprocess": [], "ocr": [], "extract": [], "document": []}
+                hits = total_fields = page_total = 0
+                page_counts_seen = set()
+                for n in range(docs):
+                    file_bytes, is_pdf, expected = make_document(style, pages, width, seed + n)
+                    t0 = time.perf_counter()
+                    page_count, fields = run_document(file_bytes, is_pdf, timings, run_ocr)
+                    timings["document"].append(time.perf_counter() - t0)
+                    page_total += page_count
+                    page_counts_seen.add(page_count)
+                    if run_ocr:
+                        h, t = field_accuracy(fields, expected)
+                        hits += h
+                        total_fields += t
+                elapsed = sum(timings["document"])
+                runs.append({
+                    "style": style,
+                    "width_px": width,
+                    # Pages the documents actually had, which is what pages_per_sec counts
+                    "pages": page_counts_seen.pop() if len(page_counts_seen) == 1 else sorted(page_counts_seen),
+                    "documents": docs,
+                    "pages_per_sec": round(page_total / elapsed, 3) if elapsed else None,
+                    "field_accuracy": round(hits / total_fields, 3) if total_fields else None,
+                    "stages_ms": {
+                        stage: {
+                            "p50": round(percentile(samples, 50) * 1000, 2),
+                            "p95": round(percentile(samples, 95) * 1000, 2),
+                        }
+                        for stage, samples in timings.items() if samples
+                    },
+                })
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OCR and extraction throughput on synthetic invoices.")
+    parser.add_argument("--styles", default=",".join(STYLES), help="comma-separated: " + ", ".join(STYLES))
+    parser.add_argument("--widths", default="1240,2480", help="page widths in px (A4 at 150/300 DPI by default)")
+    parser.add_argument("--pages", default="1,3", help="comma-separated page counts")
+    parser.add_argument("--docs", type=int, default=3, help="documents per style/width/page-count combination")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-ocr", action="store_true", help="skip Tesseract (times render/preprocess/extract only)")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    runs = run_benchmark(
+        styles=args.styles.split(","),
+        widths=[int(w) for w in args.widths.split(",")],
+        page_counts=[int(p) for p in args.pages.split(",")],
+        docs=args.docs,
+        seed=args.seed,
+        run_ocr=not args.no_ocr,
+    )
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "engine": None if args.no_ocr else get_engine().name,
+        "peak_rss_mb": peak_rss_mb(),
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
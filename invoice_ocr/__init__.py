@@ -0,0 +1,7 @@
+"""Headless OCR and field-extraction building blocks shared by app.py and run_full_pipeline.py.
+
+Importing the package is cheap: OpenCV, PyMuPDF, PIL and the OCR engines are
+only loaded when a document is actually processed.
+"""
+from .extract import extract_fields
+from .preprocess import OCRDocument, ocr_document, preprocess_image_for_ocr
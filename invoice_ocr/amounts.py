@@ -0,0 +1,158 @@
+"""Total Amount selection by scoring every monetary token on the page.
+
+Each amount found in the OCR text becomes a candidate with a fixed-width
+feature row (keyword proximity, currency symbol, table row, magnitude rank,
+...). Scoring is a single matrix-vector product, so re-scoring stored
+candidates after tuning ``WEIGHTS`` costs one numpy pass, not a re-parse of
+the text; ``pick_totals`` does the same for many documents at once.
+"""
+import re
+
+# Numbers after a currency prefix, discarding those immediately followed by % (= tax rate)
+CURRENCY_VALUE_RE = re.compile(
+    r'([₹\$€£]|Rs\.?\s*|INR\s*)\s*(\d{1,8}(?:\.\d{1,2})?)(?!\s*%)', re.IGNORECASE
+)
+TABLE_DECIMAL_RE = re.compile(r'\b(\d{1,6}\.\d{2})\b(?!\s*%)')
+TOTAL_KEYWORD_RE = re.compile(r'total|grand|payable|amount\s+due|balance\s+due|net\s+amount', re.IGNORECASE)
+# Lines that mention a total keyword but carry a partial amount
+PARTIAL_KEYWORD_RE = re.compile(r'sub\s*-?\s*total|tax|gst|discount|shipping|delivery|round', re.IGNORECASE)
+
+MAX_AMOUNT = 200000
+# A keyword on the line above still counts (label and value are often split by OCR)
+KEYWORD_REACH = 2
+
+SYMBOL_NONE, SYMBOL_HOME, SYMBOL_FOREIGN = 0, 1, 2
+FOREIGN_SYMBOLS = {"$", "€", "£"}
+
+FEATURES = (
+    "keyword",       # total keyword on the same line
+    "keyword_near",  # 1/(1+distance) to a keyword on one of the lines above
+    "partial",       # subtotal/tax/discount line
+    "symbol_home",   # ₹ / Rs / INR prefix
+    "symbol_foreign",
+    "table_row",     # bare decimal in a "|" table row
+    "magnitude",     # rank among the document's candidates, 0 (smallest) .. 1 (largest)
+    "repeated",      # same value appears more than once
+    "position",      # line index / line count, totals sit near the bottom
+)
+WEIGHTS = (2.5, 1.0, -2.0, 0.5, -1.5, -0.5, 2.0, 0.5, 0.5)
+
+
+def _weights(weights):
+    import numpy as np
+
+    w = np.asarray(WEIGHTS if weights is None else weights, dtype=np.float64)
+    if w.shape != (len(FEATURES),):
+        raise ValueError(f"expected {len(FEATURES)} weights, got {w.shape}")
+    return w
+
+
+def amount_candidates(lines):
+    """Return (values, features) arrays for every monetary token in ``lines``.
+
+    ``values`` has shape (n,), ``features`` (n, len(FEATURES)); both are empty
+    when the text has no amounts.
+    """
+    import numpy as np
+
+    values, line_idx, symbols, table = [], [], [], []
+    keyword_lines = []
+    partial_lines = []
+    for i, ln in enumerate(lines):
+        if TOTAL_KEYWORD_RE.search(ln):
+            keyword_lines.append(i)
+            if PARTIAL_KEYWORD_RE.search(ln):
+                partial_lines.append(i)
+        for prefix, number in CURRENCY_VALUE_RE.findall(ln):
+            values.append(float(number))
+            line_idx.append(i)
+            symbols.append(SYMBOL_FOREIGN if prefix in FOREIGN_SYMBOLS else SYMBOL_HOME)
+            table.append(False)
+        if '|' in ln:
+            for number in TABLE_DECIMAL_RE.findall(ln):
+                values.append(float(number))
+                line_idx.append(i)
+                symbols.append(SYMBOL_NONE)
+                table.append(True)
+
+    values = np.array(values, dtype=np.float64)
+    keep = (values > 0) & (values < MAX_AMOUNT)
+    values = values[keep]
+    n = len(values)
+    features = np.zeros((n, len(FEATURES)), dtype=np.float64)
+    if n == 0:
+        return values, features
+
+    line_idx = np.array(line_idx, dtype=np.int64)[keep]
+    symbols = np.array(symbols, dtype=np.int8)[keep]
+    table = np.array(table, dtype=bool)[keep]
+
+    is_keyword = np.zeros(len(lines) + 1, dtype=bool)
+    is_keyword[keyword_lines] = True
+    is_partial = np.zeros(len(lines) + 1, dtype=bool)
+    is_partial[partial_lines] = True
+
+    features[:, 0] = is_keyword[line_idx] & ~is_partial[line_idx]
+    # Distance to the nearest keyword line at or above each candidate (within reach)
+    near = np.zeros(n)
+    for d in range(1, KEYWORD_REACH + 1):
+        above = line_idx - d
+        valid = above >= 0
+        hit = np.zeros(n, dtype=bool)
+        hit[valid] = is_keyword[above[valid]] & ~is_partial[above[valid]]
+        near = np.where(hit & (near == 0), 1.0 / (1 + d), near)
+    features[:, 1] = near
+    features[:, 2] = is_partial[line_idx]
+    features[:, 3] = symbols == SYMBOL_HOME
+    features[:, 4] = symbols == SYMBOL_FOREIGN
+    features[:, 5] = table
+    # Dense rank so repeated values share a rank
+    uniq, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    features[:, 6] = inverse / max(1, len(uniq) - 1) if len(uniq) > 1 else 1.0
+    features[:, 7] = counts[inverse] > 1
+    features[:, 8] = line_idx / max(1, len(lines) - 1)
+    return values, features
+
+
+def score(features, weights=None):
+    return features @ _weights(weights)
+
+
+def pick_total(values, features, weights=None):
+    """Best candidate as (value, confidence), or (None, 0.0) without candidates.
+
+    Confidence is the softmax probability of the winner among the document's candidates.
+    """
+    import numpy as np
+
+    if len(values) == 0:
+        return None, 0.0
+    s = score(features, weights)
+    best = int(np.argmax(s))
+    p = np.exp(s - s[best])
+    return float(values[best]), float(1.0 / p.sum())
+
+
+def pick_totals(doc_ids, values, features, weights=None):
+    """Vectorised ``pick_total`` over candidates from many documents.
+
+    ``doc_ids`` labels each candidate row with its document and must be sorted.
+    Returns (unique doc ids, best values, confidences).
+    """
+    import numpy as np
+
+    doc_ids = np.asarray(doc_ids)
+    if len(doc_ids) == 0:
+        return doc_ids, np.empty(0), np.empty(0)
+    s = score(features, weights)
+    starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+    seg = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(doc_ids)]))
+
+    seg_max = np.maximum.reduceat(s, starts)
+    p = np.exp(s - seg_max[seg])
+    confidence = 1.0 / np.add.reduceat(p, starts)
+    # First row of each segment reaching the segment max
+    is_best = s == seg_max[seg]
+    rows = np.flatnonzero(is_best)
+    first = rows[np.r_[True, seg[rows][1:] != seg[rows][:-1]]]
+    return doc_ids[starts], values[first], confidence
@@ -0,0 +1,135 @@
+"""Persistent, content-addressed cache of per-page OCR text and word boxes.
+
+Entries are keyed by the SHA-256 of the uploaded file bytes plus every setting
+that changes what Tesseract sees (DPI, threshold, scale, ``--psm`` ...), so a
+resubmitted invoice is never OCR'd twice. The cache is a single SQLite file that
+is safe to share between worker processes; once it grows past ``max_bytes`` the
+least recently used documents are evicted.
+
+Location defaults to ``~/.cache/invoice_ocr/ocr_cache.sqlite3`` and can be
+changed with ``INVOICE_OCR_CACHE`` (set it to ``off`` to disable caching).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Bump when preprocessing changes in a way the parameters below don't capture
+CACHE_VERSION = 4
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_PATH = Path.home() / ".cache" / "invoice_ocr" / "ocr_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    key TEXT PRIMARY KEY,
+    page_count INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_last_used ON documents (last_used);
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    words BLOB,
+    source TEXT,
+    PRIMARY KEY (key, page)
+);
+"""
+
+
+def cache_key(file_bytes, **params):
+    """Hash the file contents together with the OCR/preprocessing parameters."""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    settings = json.dumps({"version": CACHE_VERSION, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{digest}|{settings}".encode("utf-8")).hexdigest()
+
+
+class OCRCache:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # Caches created before word boxes and page sources were stored
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}
+        for column, kind in (("words", "BLOB"), ("source", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE pages ADD COLUMN {column} {kind}")
+
+    def get(self, key):
+        """Return the cached (source, text, words blob or None) of each page of ``key``, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_count FROM documents WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            pages = self._conn.execute(
+                "SELECT source, text, words FROM pages WHERE key = ? ORDER BY page", (key,)
+            ).fetchall()
+            if len(pages) != row[0]:
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE documents SET last_used = ? WHERE key = ?", (time.time(), key)
+                )
+            return pages
+
+    def put(self, key, pages):
+        """Store ``pages`` as (source, text, serialised ``PageWords`` or None) triples.
+
+        The source is how the page was read ("ocr", "roi", "fast", ...), so a
+        cached cheap pass is still recognised as one.
+        """
+        size = sum(len(t.encode("utf-8")) + len(w or b"") for _, t, w in pages)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self._conn.executemany(
+                "INSERT INTO pages (key, page, source, text, words) VALUES (?, ?, ?, ?, ?)",
+                [(key, i, src, t, w) for i, (src, t, w) in enumerate(pages)],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (key, page_count, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, len(pages), size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM documents ORDER BY last_used"):
+            stale.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._conn.executemany("DELETE FROM pages WHERE key = ?", stale)
+        self._conn.executemany("DELETE FROM documents WHERE key = ?", stale)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache, or None when caching is turned off."""
+    global _cache
+    location = os.environ.get("INVOICE_OCR_CACHE", str(DEFAULT_PATH))
+    if location.lower() in ("", "off", "0", "none"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = OCRCache(location)
+        return _cache
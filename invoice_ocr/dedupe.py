@@ -0,0 +1,190 @@
+"""Duplicate invoice detection across batches and against everything seen before.
+
+Two signals are kept per processed document in a single SQLite file:
+
+* an exact key (normalised vendor + invoice number + total), which catches
+  resubmissions however differently the bill was scanned;
+* a MinHash signature of the OCR text's word shingles, bucketed with LSH, which
+  catches the same bill arriving as a scan and as a PDF even when OCR noise
+  garbles one of the key fields.
+
+Both lookups hit SQLite indexes, so checking a document costs a handful of
+index probes whatever the size of the corpus.
+"""
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+NUM_PERM = 64
+BANDS = 16  # rows per band = NUM_PERM // BANDS; candidates from ~50% similarity up
+SHINGLE_WORDS = 3
+NEAR_DUPLICATE_SIMILARITY = 0.8
+MERSENNE_PRIME = (1 << 61) - 1
+# Bump when signatures change; older ones are dropped (exact keys are kept)
+SIGNATURE_VERSION = 2
+_SEED = 0x1F0CE
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+NON_ALNUM_RE = re.compile(r'[^a-z0-9]')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    ref TEXT NOT NULL,
+    exact_key TEXT,
+    signature BLOB,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_exact_key ON documents (exact_key);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_lookup ON bands (band, hash);
+"""
+
+_permutations = None
+
+
+def _get_permutations():
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+
+        rng = np.random.default_rng(_SEED)
+        a = rng.integers(1, MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+        b = rng.integers(0, MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+        _permutations = (a, b)
+    return _permutations
+
+
+def _mod_p(v):
+    """``v % MERSENNE_PRIME`` for uint64 arrays, using 2**61 = 1 (mod p)."""
+    import numpy as np
+
+    p = np.uint64(MERSENNE_PRIME)
+    v = (v & p) + (v >> np.uint64(61))
+    return np.where(v >= p, v - p, v)
+
+
+def _mul_mod_p(a, x):
+    """``a * x % MERSENNE_PRIME`` for a < p and x < 2**32, without overflowing uint64.
+
+    With a = a_hi * 2**32 + a_lo: a_lo * x < 2**64, and a_hi * x < 2**61 is
+    multiplied by 2**32 by splitting it at bit 29 (2**61 = 1 again).
+    """
+    import numpy as np
+
+    a_hi, a_lo = a >> np.uint64(32), a & np.uint64(0xFFFFFFFF)
+    low = _mod_p(a_lo * x)
+    t = a_hi * x
+    high = _mod_p((t >> np.uint64(29)) + ((t & np.uint64((1 << 29) - 1)) << np.uint64(32)))
+    return _mod_p(low + high)
+
+
+def exact_key(vendor, invoice_number, total):
+    """Normalised vendor|number|total, or None when any part is missing."""
+    vendor = NON_ALNUM_RE.sub("", (vendor or "").lower())
+    number = NON_ALNUM_RE.sub("", (invoice_number or "").lower())
+    total = re.sub(r'[^\d.]', "", total or "")
+    if not (vendor and number and total):
+        return None
+    return f"{vendor}|{number}|{float(total):.2f}"
+
+
+def signature(text):
+    """MinHash signature (uint64 array of NUM_PERM) of the text's word shingles, or None if too short."""
+    import numpy as np
+
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    a, b = _get_permutations()
+    hashes = _mod_p(_mul_mod_p(a[:, None], x[None, :]) + b[:, None])
+    return hashes.min(axis=1)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return float((sig_a == sig_b).mean())
+
+
+def band_hashes(sig):
+    rows = NUM_PERM // BANDS
+    # SQLite integers are signed 64-bit; crc32 of the band bytes fits comfortably
+    return [zlib.crc32(sig[i * rows:(i + 1) * rows].tobytes()) for i in range(BANDS)]
+
+
+class DuplicateIndex:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+        if version < SIGNATURE_VERSION:
+            # Signatures from another hash scheme never match new ones
+            with self._conn:
+                self._conn.execute("DELETE FROM bands")
+                self._conn.execute("UPDATE documents SET signature = NULL")
+                self._conn.execute(f"PRAGMA user_version = {SIGNATURE_VERSION}")
+
+    def find(self, key, sig, exclude=None):
+        """Earlier documents that look like duplicates: [{"ref", "reason", "similarity"}].
+
+        ``exclude`` drops matches with that ref (the same file processed again).
+        """
+        import numpy as np
+
+        matches = {}
+        with self._lock:
+            if key is not None:
+                for (ref,) in self._conn.execute(
+                    "SELECT ref FROM documents WHERE exact_key = ?", (key,)
+                ):
+                    matches[ref] = {"ref": ref, "reason": "exact", "similarity": 1.0}
+            if sig is not None:
+                candidates = set()
+                for band, h in enumerate(band_hashes(sig)):
+                    candidates.update(doc_id for (doc_id,) in self._conn.execute(
+                        "SELECT doc_id FROM bands WHERE band = ? AND hash = ?", (band, h)
+                    ))
+                for doc_id in candidates:
+                    ref, blob = self._conn.execute(
+                        "SELECT ref, signature FROM documents WHERE id = ?", (doc_id,)
+                    ).fetchone()
+                    sim = similarity(sig, np.frombuffer(blob, dtype=np.uint64))
+                    if sim >= NEAR_DUPLICATE_SIMILARITY and ref not in matches:
+                        matches[ref] = {"ref": ref, "reason": "near", "similarity": round(sim, 3)}
+        matches.pop(exclude, None)
+        return sorted(matches.values(), key=lambda m: -m["similarity"])
+
+    def add(self, ref, key, sig):
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO documents (ref, exact_key, signature, recorded_at) VALUES (?, ?, ?, ?)",
+                (str(ref), key, sig.tobytes() if sig is not None else None, time.time()),
+            )
+            if sig is not None:
+                self._conn.executemany(
+                    "INSERT INTO bands (band, hash, doc_id) VALUES (?, ?, ?)",
+                    [(band, h, cur.lastrowid) for band, h in enumerate(band_hashes(sig))],
+                )
+
+    def check(self, ref, key, sig):
+        """Find duplicates of a document, then record it so later ones match it too."""
+        matches = self.find(key, sig, exclude=str(ref))
+        self.add(ref, key, sig)
+        return matches
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
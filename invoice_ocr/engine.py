@@ -0,0 +1,170 @@
+"""Pluggable OCR engines.
+
+``TesserocrEngine`` keeps a Tesseract API handle alive for the whole worker, so
+the ``eng`` traineddata is loaded once and pages are passed in as raw buffers.
+``PytesseractEngine`` is the original behaviour (temp file + tesseract CLI per
+page) and is used whenever tesserocr is not installed.
+
+Pick a backend with the ``INVOICE_OCR_ENGINE`` environment variable
+(``auto`` / ``tesserocr`` / ``pytesseract``).
+"""
+import os
+import threading
+from pathlib import Path
+
+DEFAULT_CONFIG = "--oem 3 --psm 6"
+DEFAULT_LANG = "eng"
+
+TESSERACT_WINDOWS_PATH = Path(r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+
+
+def parse_config(config):
+    """Split a tesseract CLI config string into (oem, psm, {variable: value})."""
+    oem, psm, variables = 3, 3, {}
+    tokens = config.split()
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok == "--oem" and i + 1 < len(tokens):
+            oem = int(tokens[i + 1])
+            i += 1
+        elif tok == "--psm" and i + 1 < len(tokens):
+            psm = int(tokens[i + 1])
+            i += 1
+        elif tok == "-c" and i + 1 < len(tokens):
+            key, _, value = tokens[i + 1].partition("=")
+            variables[key] = value
+            i += 1
+        i += 1
+    return oem, psm, variables
+
+
+def parse_tsv(tsv):
+    """Word rows of Tesseract TSV output as (block, par, line, left, top, width, height, conf, text)."""
+    words = []
+    for row in tsv.splitlines():
+        cols = row.split("\t")
+        # Level 5 rows are words; the header row (pytesseract) and layout rows are skipped
+        if len(cols) < 12 or cols[0] != "5" or not cols[11].strip():
+            continue
+        words.append((
+            int(cols[2]), int(cols[3]), int(cols[4]),
+            int(cols[6]), int(cols[7]), int(cols[8]), int(cols[9]),
+            float(cols[10]), cols[11],
+        ))
+    return words
+
+
+class PytesseractEngine:
+    """Subprocess backend: one tesseract CLI run per page."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang=DEFAULT_LANG):
+        import pytesseract
+        if TESSERACT_WINDOWS_PATH.exists():
+            pytesseract.pytesseract.tesseract_cmd = str(TESSERACT_WINDOWS_PATH)
+        self._pytesseract = pytesseract
+        self.lang = lang
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        # pytesseract accepts both PIL images and numpy arrays
+        return self._pytesseract.image_to_string(image, lang=self.lang, config=config)
+
+    def image_to_data(self, image, config=DEFAULT_CONFIG):
+        """Recognised words with boxes and confidences, see ``parse_tsv``."""
+        return parse_tsv(self._pytesseract.image_to_data(image, lang=self.lang, config=config))
+
+
+class TesserocrEngine:
+    """In-process backend: long-lived PyTessBaseAPI handles fed with raw pixel buffers."""
+
+    name = "tesserocr"
+
+    def __init__(self, lang=DEFAULT_LANG):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.lang = lang
+        # OEM and -c variables are fixed at Init time, so keep one handle per combination
+        self._apis = {}
+        # Load the traineddata now so a broken install falls back before the first page
+        oem, _, variables = parse_config(DEFAULT_CONFIG)
+        self._api(oem, variables)
+
+    def _api(self, oem, variables):
+        key = (oem, tuple(sorted(variables.items())))
+        api = self._apis.get(key)
+        if api is None:
+            api = self._tesserocr.PyTessBaseAPI(
+                lang=self.lang, oem=oem, variables=variables
+            )
+            self._apis[key] = api
+        return api
+
+    def _set_image(self, image, config):
+        import numpy as np
+
+        oem, psm, variables = parse_config(config)
+        api = self._api(oem, variables)
+        api.SetPageSegMode(psm)
+
+        arr = np.asarray(image)
+        if arr.dtype == bool:
+            arr = arr.astype(np.uint8) * 255
+        arr = np.ascontiguousarray(arr, dtype=np.uint8)
+        h, w = arr.shape[:2]
+        bpp = 1 if arr.ndim == 2 else arr.shape[2]
+        api.SetImageBytes(arr.tobytes(), w, h, bpp, w * bpp)
+        return api
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        api = self._set_image(image, config)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def image_to_data(self, image, config=DEFAULT_CONFIG):
+        """Recognised words with boxes and confidences, see ``parse_tsv``."""
+        api = self._set_image(image, config)
+        try:
+            return parse_tsv(api.GetTSVText(0))
+        finally:
+            api.Clear()
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+ENGINES = {
+    TesserocrEngine.name: TesserocrEngine,
+    PytesseractEngine.name: PytesseractEngine,
+}
+
+_local = threading.local()
+
+
+def create_engine(name=None, lang=DEFAULT_LANG):
+    """Build an engine by name; ``auto`` prefers tesserocr and falls back to the CLI."""
+    name = name or os.environ.get("INVOICE_OCR_ENGINE", "auto")
+    if name != "auto":
+        return ENGINES[name](lang=lang)
+    try:
+        return TesserocrEngine(lang=lang)
+    except (ImportError, RuntimeError):
+        return PytesseractEngine(lang=lang)
+
+
+def get_engine():
+    """Return this thread's engine, creating it on first use.
+
+    Tesseract handles are not thread-safe, so every worker thread (and every
+    worker process) gets its own instance that lives until the worker exits.
+    """
+    engine = getattr(_local, "engine", None)
+    if engine is None:
+        engine = create_engine()
+        _local.engine = engine
+    return engine
@@ -0,0 +1,287 @@
+"""Field extraction from raw OCR text.
+
+Every pattern is compiled once at import. Labelled fields are searched over the
+whole OCR text (Tesseract often splits a label and its value across lines);
+everything line-oriented is handled in a single pass over the lines.
+"""
+import datetime
+import functools
+import re
+
+from . import metrics
+from .amounts import amount_candidates, pick_total
+from .templates import DATE_VALUE, get_registry
+
+LABEL_RULES = [
+    # Handles "Invoice Number :AMD2-9374"
+    ("Invoice Number", "id", re.compile(r'(?i)Invoice\s+(?:Number|No|Details)\s*[:-]?\s*([A-Za-z0-9\-_]+)')),
+    # Standard Order Number/ID (also catches garbled OCR like "Order td:" for "Order Id:")
+    ("Order ID", "id", re.compile(r'(?i)Order\s+(?:Number|No|ID?|td)\s*[:\-]?\s*([A-Za-z0-9\-_]+)')),
+    # Handles DD.MM.YYYY, YYYY.MM.DD, DD-MMM-YYYY, DD MMM YYYY etc.
+    ("Invoice Date", "date", re.compile(r'(?i)(?:Invoice|Bill|Document)?\s*Date\s*[:-]?\s*' + DATE_VALUE)),
+    ("Order Date", "date", re.compile(r'(?i)Order\s*Date\s*[:-]?\s*' + DATE_VALUE)),
+    ("Due Date", "date", re.compile(r'(?i)(?:Due|Pay By)\s*Date\s*[:-]?\s*' + DATE_VALUE)),
+]
+
+MULTI_SPACE_RE = re.compile(r'\s{2,}')
+LEADING_NON_WORD_RE = re.compile(r'^[^\w]+')
+TOTAL_AMOUNT_LABEL_RE = re.compile(r'total\s+amount\s*:')
+# Utility-bill style account numbers: 123-456-7890
+ACCOUNT_NUMBER_RE = re.compile(r'\b\d{3}-\d{3}-\d{4}\b')
+
+WORD_HYPHEN_RE = re.compile(r'(\w)-(\w)')
+PAISA_RE = re.compile(r'\band\s+((?:\w+\s+){1,2}?)paisa')
+FILLER_WORDS_RE = re.compile(r'\b(?:indian|rupees?|only|and)\b')
+POINT_RE = re.compile(r'point\s+(\w+)')
+NUMBER_WORDS = {
+    "zero":0,"one":1,"two":2,"three":3,"four":4,"five":5,
+    "six":6,"seven":7,"eight":8,"nine":9,"ten":10,
+    "eleven":11,"twelve":12,"thirteen":13,"fourteen":14,"fifteen":15,
+    "sixteen":16,"seventeen":17,"eighteen":18,"nineteen":19,
+    "twenty":20,"thirty":30,"forty":40,"fifty":50,
+    "sixty":60,"seventy":70,"eighty":80,"ninety":90,
+    "hundred":100,"thousand":1000,"lakh":100000,
+}
+
+
+@functools.lru_cache(maxsize=8192)
+def _parse_date_cached(raw, today, dayfirst=False):
+    # `today` is only part of the cache key: dateutil fills missing fields from it
+    import dateutil.parser
+
+    try:
+        return dateutil.parser.parse(raw, fuzzy=True, dayfirst=dayfirst)
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_date(raw, dayfirst=False):
+    return _parse_date_cached(raw, datetime.date.today(), dayfirst)
+
+
+def parse_indian_rupee_words(sentence):
+    """Parse 'Indian Rupee X And Y Paisa only' style strings."""
+    s = sentence.lower()
+    # Normalize hyphens in compound numbers: "sixty-four" → "sixty four"
+    s = WORD_HYPHEN_RE.sub(r'\1 \2', s)
+    # Split on 'and ... paisa' to separate rupees from paisa
+    paisa_val = 0
+    paisa_m = PAISA_RE.search(s)
+    if paisa_m:
+        # "thirty five paisa" → 35
+        paisa_val = sum(NUMBER_WORDS.get(w, 0) for w in paisa_m.group(1).split())
+        s = s[:paisa_m.start()]  # keep only rupee part
+
+    # Remove filler words (whole words only: "and" is also inside "thousand")
+    s = FILLER_WORDS_RE.sub(" ", s)
+
+    # Point / decimal handling: "sixty four point one" → 64.1
+    point_val = 0
+    point_m = POINT_RE.search(s)
+    if point_m:
+        point_val = NUMBER_WORDS.get(point_m.group(1), 0) / 10.0
+        s = s[:point_m.start()]
+
+    # Sum tokens left-to-right (simple accumulator for < 10 lakh amounts)
+    tokens = [t.strip() for t in s.split() if t.strip() in NUMBER_WORDS]
+    total = 0
+    current = 0
+    for token in tokens:
+        v = NUMBER_WORDS[token]
+        if v == 100:
+            current = (current or 1) * 100
+        elif v >= 1000:
+            total += (current or 1) * v
+            current = 0
+        else:
+            current += v
+    total += current
+    result = total + point_val + paisa_val / 100.0
+    return result if result > 0 else None
+
+
+def extract_fields(text):
+    with metrics.stage("extract", chars=len(text)):
+        return _extract_fields(text)
+
+
+def empty_fields():
+    return {
+        "Invoice Number": "Not found",
+        "Order ID": "Not found",
+        "Vendor Name": "Not found",
+        "Invoice Date": "Not found",
+        "Order Date": "Not found",
+        "Due Date": "Not found",
+        "Total Amount": "Not found",
+        "Total Amount Confidence": "Not found",
+        "Account Number": "Not found"
+    }
+
+
+# A vendor template's result is used on its own only when it found all of these
+CORE_FIELDS = ("Invoice Number", "Invoice Date", "Vendor Name", "Total Amount")
+
+
+def _label_value(kind, raw):
+    """Normalise a labelled value; None when it can't be used."""
+    if kind == "id":
+        return raw.upper()
+    if kind in ("date", "date_dmy"):
+        parsed_dt = parse_date(raw, dayfirst=kind == "date_dmy")
+        return parsed_dt.strftime("%Y-%m-%d") if parsed_dt else raw
+    if kind == "words":
+        amount = parse_indian_rupee_words(raw)
+    elif kind == "amount":
+        try:
+            amount = float(raw.replace(",", ""))
+        except ValueError:
+            return None
+    else:
+        return raw
+    return f"₹ {amount:.2f}" if amount else None
+
+
+def apply_template(template, text):
+    """Fields found by a vendor template's own rules (only the ones that matched)."""
+    found = {}
+    for field, kind, pattern in template.rules:
+        if field in found:
+            continue
+        m = pattern.search(text)
+        if not m:
+            continue
+        value = _label_value(kind, m.group(1).strip())
+        if value is None:
+            continue
+        found[field] = value
+        if field == "Total Amount":
+            found["Total Amount Confidence"] = "1.00"
+    return found
+
+
+def cross_populate(data):
+    """Fill empty cards from alternate labels."""
+    if data["Order ID"] == "Not found" and data["Invoice Number"] != "Not found":
+        data["Order ID"] = data["Invoice Number"]
+    elif data["Invoice Number"] == "Not found" and data["Order ID"] != "Not found":
+        data["Invoice Number"] = data["Order ID"]
+
+    if data["Order Date"] == "Not found" and data["Invoice Date"] != "Not found":
+        data["Order Date"] = data["Invoice Date"]
+    elif data["Invoice Date"] == "Not found" and data["Order Date"] != "Not found":
+        data["Invoice Date"] = data["Order Date"]
+
+
+def _extract_fields(text):
+    data = empty_fields()
+    if not text.strip():
+        return data
+
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+
+    # Known vendors take their template's short, precise path; whatever it
+    # misses (and every unknown vendor) goes through the generic heuristics
+    with metrics.stage("template_match") as span:
+        template = get_registry().match(lines)
+        span.set(template=template.name if template else None)
+    if template is not None:
+        data.update(apply_template(template, text))
+        cross_populate(data)
+        if all(data[field] != "Not found" for field in CORE_FIELDS):
+            metrics.count("template_hits")
+            return data
+        metrics.count("template_fallbacks")
+
+    for field, value in _extract_generic(text, lines).items():
+        if data[field] == "Not found":
+            data[field] = value
+    cross_populate(data)
+    return data
+
+
+def _extract_generic(text, lines):
+    data = empty_fields()
+
+    # 1. LABELLED FIELDS (invoice/order numbers and dates)
+    for field, kind, pattern in LABEL_RULES:
+        m = pattern.search(text)
+        if m:
+            data[field] = _label_value(kind, m.group(1).strip())
+
+    # 2. SINGLE PASS OVER LINES
+    # KEY INSIGHT from real OCR analysis for the total:
+    # - Zomato: "IGST@ 38.00%" → 38.00 is a TAX RATE %, NOT an amount. Must be excluded.
+    # - Zomato: "Total Amount: Indian Rupee One And Zero Paisa only" → real total from words
+    # - Amazon: "Amount in Words: Two Hundred Sixty-four Point One only" → 264.10
+    # - Tesseract reads ₹ as % on some fonts — both treated as currency prefix
+    sold_by_vendor = None
+    caps_vendor = None
+    need_fallback_date = data["Invoice Date"] == "Not found"
+    fallback_date = None
+    aiw_val = None
+    account_no = None
+
+    for i, ln in enumerate(lines):
+        ll = ln.lower()
+
+        # Vendor: Amazon/Zomato specific markers like "Sold By:", vendor on the next line
+        if sold_by_vendor is None and ("Sold By:" in ln or "Sold by:" in ln) and i + 1 < len(lines):
+            # Vendors are often separated by large whitespace from user address on same line
+            sold_by_vendor = MULTI_SPACE_RE.split(lines[i+1])[0].strip()
+
+        # Vendor fallback: the first clean ALL CAPS line that isn't a standard document string
+        if caps_vendor is None and i < 10:
+            clean_ln = LEADING_NON_WORD_RE.sub('', ln).strip()
+            if len(clean_ln) > 4 and clean_ln.isupper() and "INVOICE" not in clean_ln and "ORIGINAL" not in clean_ln:
+                caps_vendor = clean_ln
+
+        # Invoice date fallback using fuzzy parsing of any line mentioning a date
+        if need_fallback_date and fallback_date is None and "date" in ll:
+            with metrics.stage("date_fallback"):
+                dt = parse_date(ln)
+            if dt is not None and 2000 <= dt.year <= 2050:
+                fallback_date = dt.strftime("%Y-%m-%d")
+
+        # Total from words
+        if aiw_val is None:
+            # Zomato style: "Total Amount: Indian Rupee One And Zero Paisa only"
+            if TOTAL_AMOUNT_LABEL_RE.search(ll):
+                aiw_val = parse_indian_rupee_words(ln.split(':', 1)[-1].strip())
+            # Amazon style: "Amount in Words:" followed by words on next line
+            if aiw_val is None and "amount in words" in ll:
+                words_src = ln
+                if ':' in ln:
+                    words_src = ln.split(':', 1)[-1].strip()
+                if len(words_src) < 5 and i+1 < len(lines):
+                    words_src = lines[i+1]
+                aiw_val = parse_indian_rupee_words(words_src)
+
+        if account_no is None:
+            acc_m = ACCOUNT_NUMBER_RE.search(ln)
+            if acc_m:
+                account_no = acc_m.group()
+
+    if sold_by_vendor is not None:
+        data["Vendor Name"] = sold_by_vendor
+    elif caps_vendor is not None:
+        data["Vendor Name"] = caps_vendor
+
+    if fallback_date is not None:
+        data["Invoice Date"] = fallback_date
+
+    if account_no is not None:
+        data["Account Number"] = account_no
+
+    # 3. PICK THE TOTAL
+    # Priority: words-parsed value > best-scoring currency candidate (see amounts.py)
+    if aiw_val is not None:
+        total_val, confidence = aiw_val, 1.0
+    else:
+        total_val, confidence = pick_total(*amount_candidates(lines))
+
+    if total_val is not None:
+        data["Total Amount"] = f"₹ {total_val:.2f}"
+        data["Total Amount Confidence"] = f"{confidence:.2f}"
+
+    return data
@@ -0,0 +1,89 @@
+"""Checkpoint journal for resumable batch runs.
+
+Every successfully processed input is recorded under the SHA-256 of its
+contents, so a restarted batch skips anything already done, including files
+that were renamed or moved in the meantime. Results are buffered and written in
+bulk transactions rather than one small file per invoice. A crash loses at most
+the last unflushed batch, and those inputs are simply processed again.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+FLUSH_EVERY = 200
+FLUSH_INTERVAL = 5.0  # seconds
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    result TEXT NOT NULL,
+    recorded_at REAL NOT NULL
+);
+"""
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def has(self, content_hash):
+        if any(row[0] == content_hash for row in self._buffer):
+            return True
+        return self._conn.execute(
+            "SELECT 1 FROM results WHERE content_hash = ?", (content_hash,)
+        ).fetchone() is not None
+
+    def record(self, content_hash, file, result):
+        self._buffer.append((content_hash, str(file), json.dumps(result), time.time()))
+        if len(self._buffer) >= FLUSH_EVERY or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO results (content_hash, file, result, recorded_at) VALUES (?, ?, ?, ?)",
+                    self._buffer,
+                )
+            self._buffer.clear()
+        self._last_flush = time.monotonic()
+
+    def results(self):
+        """Yield every recorded result dict, oldest first."""
+        self.flush()
+        for (result,) in self._conn.execute("SELECT result FROM results ORDER BY recorded_at"):
+            yield json.loads(result)
+
+    def __len__(self):
+        self.flush()
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,96 @@
+"""Cheap layout pass used to OCR only the parts of a page that carry header/total fields.
+
+Vendor, invoice/order numbers and dates sit at the top of an invoice and the
+total / amount-in-words at the bottom; the rows in between are line items.
+Text lines are found with OpenCV on a low-resolution copy (no Tesseract), and
+when a page has enough lines to make it worthwhile only a header band and a
+totals band are returned for full-resolution OCR.
+"""
+LAYOUT_LONG_SIDE = 1000
+HEAD_LINES = 14
+TAIL_LINES = 8
+# Don't bother cropping unless at least this many lines would be skipped
+MIN_SKIPPED_LINES = 6
+BAND_PADDING = 0.5  # in median line heights
+
+
+def find_text_lines(gray):
+    """Return (y0, y1) spans of text lines in full-resolution coordinates, top to bottom."""
+    import cv2
+    import numpy as np
+
+    h, w = gray.shape
+    f = min(1.0, LAYOUT_LONG_SIDE / max(h, w))
+    small = cv2.resize(gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA) if f < 1.0 else gray
+    _, bw = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    # Smear horizontally so the words of one line merge into a single blob
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, small.shape[1] // 50), 1))
+    merged = cv2.dilate(bw, kernel)
+    contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    spans = []
+    max_line_h = small.shape[0] // 12
+    for c in contours:
+        x, y, cw, ch = cv2.boundingRect(c)
+        # Skip specks, and table borders/logos that swallow many lines at once
+        if ch < 3 or cw < 6 or ch > max_line_h:
+            continue
+        spans.append((y, y + ch))
+    if not spans:
+        return []
+    spans = np.array(sorted(spans), dtype=np.float64) / f
+
+    # Words of one line can survive as separate blobs; fold overlapping spans together
+    lines = [list(spans[0])]
+    for y0, y1 in spans[1:]:
+        last = lines[-1]
+        if y0 < last[1] - 0.3 * (last[1] - last[0]):
+            last[1] = max(last[1], y1)
+        else:
+            lines.append([y0, y1])
+    return [(int(y0), int(y1)) for y0, y1 in lines]
+
+
+def field_regions(gray):
+    """Horizontal bands (y0, y1) worth OCR'ing, or None to OCR the whole page."""
+    lines = find_text_lines(gray)
+    if len(lines) < HEAD_LINES + TAIL_LINES + MIN_SKIPPED_LINES:
+        return None
+    h = gray.shape[0]
+    line_h = sorted(y1 - y0 for y0, y1 in lines)[len(lines) // 2]
+    pad = int(line_h * BAND_PADDING) + 1
+    head_end = min(h, lines[HEAD_LINES - 1][1] + pad)
+    tail_start = max(head_end, lines[-TAIL_LINES][0] - pad)
+    return [(0, head_end), (tail_start, h)]
+
+
+# Layout clusters, used to pick tuned OCR settings before any text is read
+SPARSE_LINES = 12
+GUTTER_MIN_WIDTH = 0.03  # blank vertical strip, as a fraction of the page width
+
+
+def layout_cluster(gray):
+    """Coarse layout class of a page: "sparse", "columns" or "dense"."""
+    import cv2
+    import numpy as np
+
+    lines = find_text_lines(gray)
+    if len(lines) < SPARSE_LINES:
+        return "sparse"
+    h, w = gray.shape
+    f = min(1.0, LAYOUT_LONG_SIDE / max(h, w))
+    small = cv2.resize(gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA) if f < 1.0 else gray
+    _, bw = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    # Look for a blank gutter in the middle half of the text block
+    top, bottom = int(lines[0][0] * f), int(lines[-1][1] * f) + 1
+    ink = np.count_nonzero(bw[top:bottom], axis=0)
+    cols = np.flatnonzero(ink)
+    if len(cols) == 0:
+        return "sparse"
+    left, right = cols[0], cols[-1]
+    quarter = (right - left) // 4
+    blank = ink[left + quarter:right - quarter] == 0
+    # Longest run of blank columns
+    edges = np.flatnonzero(np.diff(np.r_[0, blank.astype(np.int8), 0]))
+    best = (edges[1::2] - edges[::2]).max() if len(edges) else 0
+    return "columns" if best >= GUTTER_MIN_WIDTH * small.shape[1] else "dense"
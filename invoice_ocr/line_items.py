@@ -0,0 +1,245 @@
+"""Line-item table extraction from the OCR word boxes (``words.PageWords``).
+
+No OCR of its own: the table is read from the boxes of the same pass that
+produced the text. The header row is found by its column labels
+(Description, Qty, Rate, Amount, ...). Every row below it is split into
+cells at ruling characters and at wide gaps, and column positions are
+clustered over all rows: x ranges covered by some cell form a column, empty
+vertical strips separate them. The clustering is only used if no row puts
+two cells in one column. Otherwise, and for "|"-ruled rows with a cell per
+header column, cells are matched to the header by their order in the row.
+Wrapped descriptions are joined to the item above, and a
+page without a header continues the previous page's table.
+"""
+import re
+
+from . import metrics
+
+COLUMN_LABELS = (
+    ("index", re.compile(r'^(?:s\.?\s*no|sl|sr|si|#|no)\.?$', re.IGNORECASE)),
+    ("quantity", re.compile(r'^(?:qty|quantity|units?|nos)\.?$', re.IGNORECASE)),
+    ("unit_price", re.compile(r'rate|price|mrp|unit\s*cost', re.IGNORECASE)),
+    ("amount", re.compile(r'amount|total|value', re.IGNORECASE)),
+    ("description", re.compile(r'desc|item|particular|product|service|details', re.IGNORECASE)),
+)
+NUMERIC_COLUMNS = ("quantity", "unit_price", "amount")
+# A row starting like this is past the items (totals block)
+TABLE_END_RE = re.compile(
+    r'^\W*(?:sub\s*-?\s*total|total|grand|tax|[cis]?gst|amount\s+in\s+words|balance|discount|shipping|round)',
+    re.IGNORECASE,
+)
+# Commas are thousands separators only in real 3-digit groups ("1,234.50");
+# a trailing ",dd" is a decimal comma ("204,00")
+NUMBER_RE = re.compile(r'(?P<grouped>\d{1,3}(?:,\d{3})+(?:\.\d+)?)(?!\d)|\d+(?:\.\d+|,\d{1,2}(?!\d))?')
+RULE_CHARS = "|[]"
+
+CELL_GAP = 1.2  # word gap that starts a new cell, in median word heights
+END_GAP = 3.0  # vertical gap that ends the table, in median word heights
+
+
+def _label(text):
+    for name, pattern in COLUMN_LABELS:
+        if pattern.search(text):
+            return name
+    return None
+
+
+def _number(text):
+    m = NUMBER_RE.search(text)
+    if not m:
+        return None
+    try:
+        if m.group("grouped"):
+            return float(m.group().replace(",", ""))
+        return float(m.group().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _cells(words, idx, gap):
+    """Split one text line into cells: [(x0, x1, text)], left to right."""
+    import numpy as np
+
+    cells, cur = [], []
+    x0 = x1 = 0
+    for i in idx[np.argsort(words.left[idx], kind="stable")]:
+        token = words.word(i)
+        left, right = int(words.left[i]), int(words.left[i] + words.width[i])
+        if cur and (token[0] in RULE_CHARS or left - x1 > gap):
+            cells.append((x0, x1, " ".join(cur)))
+            cur = []
+        core = token.strip(RULE_CHARS)
+        if core:
+            if not cur:
+                x0 = left
+            cur.append(core)
+            x1 = right
+        if cur and token[-1] in RULE_CHARS:
+            cells.append((x0, x1, " ".join(cur)))
+            cur = []
+    if cur:
+        cells.append((x0, x1, " ".join(cur)))
+    return cells
+
+
+def _is_ruled(words, idx):
+    """True if the line has ruling characters between its cells."""
+    return any(ch in RULE_CHARS for i in idx for ch in words.word(i))
+
+
+def _header_names(cells):
+    """Column names for a header row's cells, or None if the row isn't a table header."""
+    labels = [_label(text) for _, _, text in cells]
+    found = {label for label in labels if label}
+    if len(found) < 2 or not found & set(NUMERIC_COLUMNS):
+        return None
+    return [label or re.sub(r'\W+', "_", text.lower()).strip("_") for label, (_, _, text) in zip(labels, cells)]
+
+
+def cluster_columns(cell_rows):
+    """Column x-ranges [(x0, x1)]: maximal runs of x covered by a cell in some row."""
+    import numpy as np
+
+    spans = np.array([(x0, x1) for row in cell_rows for x0, x1, _ in row], dtype=np.int64).reshape(-1, 2)
+    if not len(spans):
+        return []
+    diff = np.zeros(int(spans[:, 1].max()) + 2, dtype=np.int32)
+    np.add.at(diff, spans[:, 0], 1)
+    np.add.at(diff, spans[:, 1], -1)
+    covered = (np.cumsum(diff) > 0).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.r_[0, covered, 0]))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+class _Table:
+    """Header and rows of a table; its column layout carries over to the next page."""
+
+    def __init__(self, header, names):
+        self.header = header
+        self.names = names
+        self.rows = []  # [(cells, ruled)]
+        self.columns = None  # [(x0, x1, name)] when cells line up across rows
+
+    def fit(self):
+        """Cluster columns over the header and rows; leaves ``columns`` None if they don't line up."""
+        self.columns = None
+        cell_rows = [self.header] + [cells for cells, _ in self.rows]
+        columns = cluster_columns(cell_rows)
+
+        def column_of(cell):
+            center = (cell[0] + cell[1]) / 2
+            return next((k for k, (c0, c1) in enumerate(columns) if c0 <= center < c1), None)
+
+        for cells in cell_rows:
+            hits = [column_of(cell) for cell in cells]
+            if None in hits or len(set(hits)) < len(hits):
+                # a cell outside every column, or two cells of one row in one
+                # column: they don't line up, use row order
+                return
+        owner = {column_of(cell): name for cell, name in zip(self.header, self.names)}
+        self.columns = [(c0, c1, owner.get(k)) for k, (c0, c1) in enumerate(columns)]
+
+    def assign(self, cells, ruled=False):
+        """{column name: text} for one row, or None if it can't be placed.
+
+        A row split on ruling characters with a cell per header column is
+        matched by order even when the columns line up, as rules are more
+        reliable than word positions.
+        """
+        by_order = len(cells) == len(self.names)
+        if self.columns is not None and not (ruled and by_order):
+            row = {}
+            for x0, x1, text in cells:
+                center = (x0 + x1) / 2
+                # Cells in a column without a header label are dropped
+                name = next((n for c0, c1, n in self.columns if c0 <= center < c1), None)
+                if name is not None:
+                    row[name] = f"{row[name]} {text}" if name in row else text
+            return row
+        if by_order:
+            return {name: text for name, (_, _, text) in zip(self.names, cells)}
+        if len(cells) == 1 and "description" in self.names:
+            return {"description": cells[0][2]}
+        return None
+
+    def take_items(self):
+        """Items from the rows collected so far (which are then cleared)."""
+        self.fit()
+        items = []
+        for cells, ruled in self.rows:
+            row = self.assign(cells, ruled)
+            if not row:
+                continue
+            item = _to_item(row)
+            if not any(name in item for name in NUMERIC_COLUMNS):
+                # Wrapped description: belongs to the item above
+                if items and set(item) == {"description"}:
+                    items[-1]["description"] = f"{items[-1].get('description', '')} {item['description']}".strip()
+                continue
+            items.append(item)
+        self.rows = []
+        return items
+
+
+def _to_item(row):
+    item = {}
+    for name, text in row.items():
+        if name == "index":
+            continue
+        if name in NUMERIC_COLUMNS:
+            value = _number(text)
+            if value is not None:
+                item[name] = f"{value:g}" if name == "quantity" else f"{value:.2f}"
+        elif text:
+            item[name] = text
+    return item
+
+
+def page_line_items(words, table=None):
+    """Line items on one page; returns (items, table still open at the page end or None)."""
+    import numpy as np
+
+    items = []
+    if words is None or not len(words):
+        return items, None
+    word_h = float(np.median(words.height)) or 1.0
+    prev_bottom = None
+    for idx in words.lines():
+        cells = _cells(words, idx, CELL_GAP * word_h)
+        if not cells:
+            continue
+        top = int(words.top[idx].min())
+        bottom = int((words.top[idx] + words.height[idx]).max())
+        if table is None:
+            names = _header_names(cells)
+            if names is not None:
+                table = _Table(cells, names)
+                prev_bottom = bottom
+            continue
+        if TABLE_END_RE.match(cells[0][2]) or (prev_bottom is not None and top - prev_bottom > END_GAP * word_h):
+            items.extend(table.take_items())
+            table = None
+            prev_bottom = None
+            continue
+        table.rows.append((cells, _is_ruled(words, idx)))
+        prev_bottom = bottom
+    if table is not None:
+        items.extend(table.take_items())
+    return items, table
+
+
+def extract_line_items(page_words):
+    """Line items of a document from each page's ``PageWords`` (None pages are skipped).
+
+    Each item is a dict with whichever of "description", "quantity",
+    "unit_price" and "amount" the table has, plus any other labelled column
+    under its header text. Numbers are normalised ("1,312.00" -> "1312.00").
+    """
+    items = []
+    with metrics.stage("line_items", pages=len(page_words)) as span:
+        table = None
+        for words in page_words:
+            page_items, table = page_line_items(words, table)
+            items.extend(page_items)
+        span.set(items=len(items))
+    return items
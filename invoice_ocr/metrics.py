@@ -0,0 +1,152 @@
+"""Opt-in per-stage timing and counters.
+
+Turn on with ``INVOICE_OCR_METRICS=1`` (or ``metrics.enable()``); use
+``INVOICE_OCR_METRICS=log`` to also print the per-stage JSON lines to stderr. While
+disabled, ``stage()`` hands back a shared no-op context manager and ``count()``
+returns immediately, so the instrumented code pays next to nothing.
+
+When enabled every finished stage is logged as one JSON line on the
+``invoice_ocr.metrics`` logger (wall/CPU time plus whatever attributes the
+call site attached, e.g. image size), and totals are kept in-process for
+``snapshot()`` / ``render_prometheus()``. Worker processes can ship their
+``snapshot()`` back to the parent, which folds them in with ``merge()``.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger("invoice_ocr.metrics")
+
+_mode = os.environ.get("INVOICE_OCR_METRICS", "").lower()
+ENABLED = _mode in ("1", "true", "yes", "on", "log")
+
+_lock = threading.Lock()
+_stages = {}    # name -> [calls, wall seconds, cpu seconds]
+_counters = {}  # name -> value
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def log_to_stderr():
+    """Emit one JSON line per finished stage on stderr."""
+    if any(getattr(h, "_invoice_ocr_metrics", False) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler._invoice_ocr_metrics = True
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopStage()
+
+
+class _Stage:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Attach attributes discovered while the stage runs (e.g. output size)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        with _lock:
+            totals = _stages.setdefault(self.name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+        if logger.isEnabledFor(logging.INFO):
+            event = {"stage": self.name, "wall_ms": round(wall * 1000, 3), "cpu_ms": round(cpu * 1000, 3)}
+            event.update(self.attrs)
+            if exc_type is not None:
+                event["error"] = exc_type.__name__
+            logger.info(json.dumps(event, default=str))
+        return False
+
+
+def stage(name, **attrs):
+    """Time a block: ``with metrics.stage("ocr", width=w, height=h): ...``"""
+    if not ENABLED:
+        return _NOOP
+    return _Stage(name, attrs)
+
+
+def count(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    with _lock:
+        return {
+            "stages": {k: list(v) for k, v in _stages.items()},
+            "counters": dict(_counters),
+        }
+
+
+def merge(snap):
+    """Fold a snapshot taken in another process into this process's totals."""
+    with _lock:
+        for name, (calls, wall, cpu) in snap.get("stages", {}).items():
+            totals = _stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+        for name, value in snap.get("counters", {}).items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def render_prometheus(prefix="invoice_ocr"):
+    """Prometheus text exposition of the current totals."""
+    snap = snapshot()
+    out = []
+    for metric, idx, help_text in (
+        ("stage_calls_total", 0, "Times each pipeline stage ran."),
+        ("stage_wall_seconds_total", 1, "Wall-clock seconds spent per stage."),
+        ("stage_cpu_seconds_total", 2, "CPU seconds spent per stage (calling thread)."),
+    ):
+        out.append(f"# HELP {prefix}_{metric} {help_text}")
+        out.append(f"# TYPE {prefix}_{metric} counter")
+        for name, totals in sorted(snap["stages"].items()):
+            out.append(f'{prefix}_{metric}{{stage="{name}"}} {totals[idx]:g}')
+    for name, value in sorted(snap["counters"].items()):
+        out.append(f"# TYPE {prefix}_{name}_total counter")
+        out.append(f"{prefix}_{name}_total {value:g}")
+    return "\n".join(out) + "\n"
+
+
+if _mode == "log":
+    log_to_stderr()
@@ -0,0 +1,79 @@
+"""Bounded, order-preserving page pipeline.
+
+Pages are produced lazily by the caller (rendering stays on the calling thread,
+PyMuPDF documents are not thread-safe) and handed to a shared thread pool for
+preprocessing and OCR. OpenCV and Tesseract both release the GIL, so threads
+are enough to keep several cores busy on one document. At most ``depth`` pages
+are in flight at any time, which caps peak memory regardless of page count.
+
+The pool is long-lived so each of its threads keeps its own OCR engine
+(see ``engine.get_engine``) across documents.
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PAGE_WORKERS = int(os.environ.get("INVOICE_OCR_PAGE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_page_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix="ocr-page")
+        return _pool
+
+
+def set_page_workers(workers):
+    """Resize the page pool; with a single worker pages are processed inline."""
+    global PAGE_WORKERS, _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+        PAGE_WORKERS = max(1, workers)
+
+
+def ordered_map(func, items, depth=None):
+    """Yield ``func(item)`` for every item, in input order, with at most ``depth`` pending."""
+    if PAGE_WORKERS == 1:
+        # Batch workers already run one process per core; stay on the caller's thread
+        for item in items:
+            yield func(item)
+        return
+    depth = depth or PAGE_WORKERS
+    pool = get_page_pool()
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+# Minimum amount of real text a PDF page must carry before we trust its text layer
+TEXT_LAYER_MIN_CHARS = 30
+TEXT_LAYER_MIN_CLEAN_RATIO = 0.8
+
+
+def has_usable_text_layer(text):
+    """Decide whether a PDF page's embedded text can replace raster OCR.
+
+    Scanned PDFs have no text layer (or a few stray characters), and PDFs with
+    broken font encodings come out as replacement characters or symbol soup;
+    both go to OCR instead.
+    """
+    chars = [ch for ch in text if not ch.isspace()]
+    if len(chars) < TEXT_LAYER_MIN_CHARS:
+        return False
+    clean = sum(1 for ch in chars if ch.isalnum() or ch in ".,:;-/#()%&@₹$€£'\"|")
+    return clean / len(chars) >= TEXT_LAYER_MIN_CLEAN_RATIO
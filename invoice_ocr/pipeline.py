@@ -0,0 +1,72 @@
+"""Per-document entry points for worker processes (batch CLI, HTTP service)."""
+import os
+
+from . import metrics
+from .engine import get_engine
+from .extract import extract_fields
+from .line_items import extract_line_items
+from .pages import set_page_workers
+from .preprocess import ocr_document
+
+# Region-of-interest OCR: read only header/totals bands first, whole pages only
+# if a required field is still missing afterwards
+ROI_ENABLED = os.environ.get("INVOICE_OCR_ROI", "").lower() in ("1", "true", "yes", "on")
+# Confidence-aware early exit: accept a cheap low-resolution pass where Tesseract
+# is confident, re-read only doubtful lines, and whole pages if fields are missing
+EARLY_EXIT_ENABLED = os.environ.get("INVOICE_OCR_EARLY_EXIT", "").lower() in ("1", "true", "yes", "on")
+REQUIRED_FIELDS = ("Invoice Number", "Invoice Date", "Vendor Name", "Total Amount")
+
+
+def init_worker():
+    """Process-pool initializer: OCR pages inline and load the OCR engine up front.
+
+    Pools already run one process per core, so a per-process page pool would
+    only oversubscribe the CPU.
+    """
+    set_page_workers(1)
+    get_engine()
+
+
+def process_document(file_bytes, is_pdf=False, roi=None, early_exit=None):
+    """OCR and extract one document; returns (fields, text, page_sources, line_items).
+
+    With ``roi`` (default: ``INVOICE_OCR_ROI``) pages are first OCR'd in
+    header/totals bands only; with ``early_exit`` (default:
+    ``INVOICE_OCR_EARLY_EXIT``) they are first read with the confidence-aware
+    cheap pass. A cheap pass that leaves a required field missing falls back to
+    the next one, and finally to plain full-page OCR. Raises ValueError when
+    the document can't be decoded at all.
+    """
+    cheap_passes = []
+    if ROI_ENABLED if roi is None else roi:
+        cheap_passes.append(("roi", {"regions": True}, ("roi",)))
+    if EARLY_EXIT_ENABLED if early_exit is None else early_exit:
+        cheap_passes.append(("early_exit", {"confidence": True}, ("fast", "refined")))
+
+    for name, options, cheap_sources in cheap_passes:
+        text, preview_image, page_sources, page_words = ocr_document(file_bytes, is_pdf=is_pdf, **options)
+        if preview_image is None:
+            raise ValueError("unreadable document")
+        fields = extract_fields(text)
+        # Nothing cheaper happened (text layer, small pages read whole), or everything needed was found
+        if not any(s in cheap_sources for s in page_sources) or all(fields[f] != "Not found" for f in REQUIRED_FIELDS):
+            return fields, text, page_sources, extract_line_items(page_words)
+        metrics.count(f"{name}_fallbacks")
+
+    text, preview_image, page_sources, page_words = ocr_document(file_bytes, is_pdf=is_pdf)
+    if preview_image is None:
+        raise ValueError("unreadable document")
+    return extract_fields(text), text, page_sources, extract_line_items(page_words)
+
+
+def process_document_measured(file_bytes, is_pdf=False):
+    """Like process_document, but also returns the metrics snapshot for just this document.
+
+    The snapshot is None when metrics are disabled; otherwise the parent process
+    folds it into its own totals with ``metrics.merge``.
+    """
+    if not metrics.ENABLED:
+        return process_document(file_bytes, is_pdf), None
+    metrics.reset()
+    result = process_document(file_bytes, is_pdf)
+    return result, metrics.snapshot()
@@ -0,0 +1,509 @@
+"""Document decoding, image preprocessing and OCR.
+
+OpenCV, NumPy, PIL and PyMuPDF are imported inside the functions that need
+them, so importing this module (e.g. from a batch worker or the CLI) is cheap.
+"""
+import io
+import functools
+from collections import namedtuple
+
+from . import metrics
+from .cache import get_cache, cache_key
+from .engine import get_engine
+from .layout import field_regions, layout_cluster
+from .pages import ordered_map, has_usable_text_layer
+from .tuning import get_tuned_configs
+from .words import PageWords
+
+OCR_CONFIG = "--oem 3 --psm 6"
+# Legacy fixed rule, used when the text height can't be estimated
+UPSCALE_BELOW = 2000
+UPSCALE_FACTOR = 2
+THRESH_BLOCK_SIZE = 31
+THRESH_C = 2
+
+# Adaptive scaling: resize each page so the median glyph lands near this height (px)
+ADAPTIVE_SCALE = True
+TARGET_TEXT_HEIGHT = 24
+MIN_SCALE, MAX_SCALE = 0.4, 3.0
+# Within this band the page is OCR'd as-is rather than resampled for a marginal gain
+NO_RESIZE_BAND = (0.8, 1.25)
+ESTIMATE_LONG_SIDE = 1200
+MIN_GLYPHS = 20
+
+# Confidence-aware early exit: pages are first read at a smaller glyph size and
+# accepted when Tesseract is confident; otherwise only the doubtful lines are
+# re-read at full size, or the whole page when too many of them are
+FAST_TEXT_HEIGHT_RATIO = 0.75
+ACCEPT_PAGE_CONF = 85
+LINE_MIN_CONF = 70
+MAX_REFINE_LINE_FRACTION = 0.3
+REFINE_PAD = 0.3  # in line heights
+REFINE_CONFIG = "--oem 3 --psm 7"  # a single text line
+ALT_THRESHOLD = (51, 10)
+
+# Previews are decoded/rendered separately at this size; only the OCR input is full resolution
+PREVIEW_LONG_SIDE = 1200
+_REDUCE_VIA = {"1": "L", "I;16": "I", "P": "RGB", "PA": "RGBA"}
+# JPEGs at least twice this long are decoded at 1/2, 1/4 or 1/8 size (libjpeg DCT scaling)
+# as long as the long side stays above it; ~A4 at 300 DPI keeps glyphs well above the OCR target
+JPEG_DRAFT_LONG_SIDE = 3500
+# Text-layer word boxes span the font's ascender to descender; OCR boxes only the ink.
+# Shrinking them to this fraction keeps gaps measured in word heights comparable.
+TEXT_LAYER_INK_HEIGHT = 0.55
+EXIF_ORIENTATION = 0x0112
+
+# What ``ocr_document`` returns: the text of all pages, an RGB preview of the
+# first page, and per page the source and ``PageWords``
+OCRDocument = namedtuple("OCRDocument", "text preview page_sources page_words")
+
+
+def estimate_text_height(gray):
+    """Median glyph height in px, from connected components of a downsampled copy.
+
+    Returns None when the page has too few glyph-like components to judge
+    (blank pages, photos), in which case the caller keeps the legacy rule.
+    """
+    import cv2
+    import numpy as np
+
+    h, w = gray.shape
+    f = min(1.0, ESTIMATE_LONG_SIDE / max(h, w))
+    small = cv2.resize(gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA) if f < 1.0 else gray
+    _, bw = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(bw, connectivity=8)
+
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Keep glyph-sized blobs: drop specks, rules/borders and large images
+    glyph = (heights >= 3) & (heights <= small.shape[0] // 8) & (widths <= heights * 4) & (widths >= 1)
+    if np.count_nonzero(glyph) < MIN_GLYPHS:
+        return None
+    return float(np.median(heights[glyph])) / f
+
+
+def choose_scale(gray, target_height=None):
+    h, w = gray.shape
+    if ADAPTIVE_SCALE:
+        text_height = estimate_text_height(gray)
+        if text_height:
+            scale = min(MAX_SCALE, max(MIN_SCALE, (target_height or TARGET_TEXT_HEIGHT) / text_height))
+            return 1.0 if NO_RESIZE_BAND[0] <= scale <= NO_RESIZE_BAND[1] else scale
+    return float(UPSCALE_FACTOR) if max(h, w) < UPSCALE_BELOW else 1.0
+
+
+def to_gray(pil_img):
+    import cv2
+    import numpy as np
+
+    if isinstance(pil_img, np.ndarray) and pil_img.ndim == 2:
+        return pil_img  # already grayscale (decode_image, or a PDF page from render_pdf_page)
+    if getattr(pil_img, "mode", None) == "L":
+        return np.asarray(pil_img)
+    with metrics.stage("grayscale"):
+        cv_img = np.array(pil_img)
+        return cv2.cvtColor(cv_img, cv2.COLOR_RGB2GRAY)
+
+
+def page_scale(gray, target_height=None):
+    h, w = gray.shape
+    with metrics.stage("estimate_scale", width=w, height=h) as span:
+        scale = choose_scale(gray, target_height)
+        span.set(scale=round(scale, 3))
+    return scale
+
+
+def binarize(gray, scale, block_size=None, c=None):
+    """Resize by ``scale`` and apply the adaptive threshold."""
+    import cv2
+
+    h, w = gray.shape
+    if scale != 1.0:
+        # Shrinking huge scans needs area averaging; enlarging keeps the bicubic filter
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        with metrics.stage("resize", width=w, height=h, factor=round(scale, 3)):
+            gray = cv2.resize(gray, (round(w * scale), round(h * scale)), interpolation=interpolation)
+
+    with metrics.stage("threshold", width=gray.shape[1], height=gray.shape[0]):
+        gray_blur = cv2.medianBlur(gray, 3)
+        thresh = cv2.adaptiveThreshold(
+            gray_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, block_size or THRESH_BLOCK_SIZE, THRESH_C if c is None else c
+        )
+    return thresh
+
+
+def ocr_settings(gray):
+    """Tuned settings for the page's layout cluster (see ``tuning``); empty means module defaults."""
+    tuned = get_tuned_configs()
+    if tuned is None:
+        return {}
+    with metrics.stage("layout_cluster") as span:
+        cluster = layout_cluster(gray)
+        span.set(cluster=cluster)
+    return tuned.lookup(cluster)
+
+
+def preprocess_page(pil_img, settings=None):
+    """Grayscale, rescale to a good glyph size and binarise; returns the uint8 array fed to OCR.
+
+    ``settings`` overrides the defaults (keys as in ``tuning.SETTING_KEYS``);
+    when omitted they are looked up from the tuned configs.
+    """
+    gray = to_gray(pil_img)
+    if settings is None:
+        settings = ocr_settings(gray)
+    scale = page_scale(gray, settings.get("text_height"))
+    return binarize(gray, scale, settings.get("block_size"), settings.get("c"))
+
+
+def ocr_image(thresh, config=None):
+    with metrics.stage("ocr", width=thresh.shape[1], height=thresh.shape[0]):
+        return get_engine().image_to_string(thresh, config=config or OCR_CONFIG)
+
+
+def ocr_words(thresh, config=None, scale=1.0):
+    """OCR a binarised page once in structured mode; boxes are mapped back by ``scale``."""
+    with metrics.stage("ocr", width=thresh.shape[1], height=thresh.shape[0]):
+        words = get_engine().image_to_data(thresh, config=config or OCR_CONFIG)
+    return PageWords.from_words(words, scale)
+
+
+def ocr_page_words(pil_img):
+    gray = to_gray(pil_img)
+    settings = ocr_settings(gray)
+    scale = page_scale(gray, settings.get("text_height"))
+    thresh = binarize(gray, scale, settings.get("block_size"), settings.get("c"))
+    return ocr_words(thresh, settings.get("config"), scale)
+
+
+def ocr_page_regions(pil_img):
+    """OCR only the header and totals bands of a page; returns (source, text, words).
+
+    Pages too short to have a line-item section in between are OCR'd whole.
+    """
+    gray = to_gray(pil_img)
+    settings = ocr_settings(gray)
+    scale = page_scale(gray, settings.get("text_height"))
+    block_size, c, config = settings.get("block_size"), settings.get("c"), settings.get("config")
+    with metrics.stage("layout", width=gray.shape[1], height=gray.shape[0]) as span:
+        bands = field_regions(gray)
+        span.set(bands=len(bands) if bands else 0)
+    if bands is None:
+        words = ocr_words(binarize(gray, scale, block_size, c), config, scale)
+        return "ocr", words.text, words
+    # Band text only: the line items in between were never read, so no word boxes either
+    return "roi", "\n".join(ocr_image(binarize(gray[y0:y1], scale, block_size, c), config) for y0, y1 in bands), None
+
+
+def ocr_data(thresh, config=None):
+    with metrics.stage("ocr_data", width=thresh.shape[1], height=thresh.shape[0]):
+        return get_engine().image_to_data(thresh, config=config or OCR_CONFIG)
+
+
+def group_lines(words):
+    """Split ``image_to_data`` words into text lines, in reading order."""
+    lines = {}
+    for word in words:
+        lines.setdefault(word[:3], []).append(word)
+    return list(lines.values())
+
+
+def mean_confidence(words):
+    """Character-weighted mean word confidence (0-100)."""
+    chars = sum(len(w[8]) for w in words)
+    return sum(w[7] * len(w[8]) for w in words) / chars if chars else 0.0
+
+
+def refine_line(gray, line, fast_scale, full_scale, settings):
+    """Re-read one doubtful line at full size, with the alternate threshold as a second try.
+
+    Returns the better of the original and re-read words, keyed like the original line
+    and with boxes in the cheap pass's coordinates.
+    """
+    h, w = gray.shape
+    x0 = min(wd[3] for wd in line) / fast_scale
+    x1 = max(wd[3] + wd[5] for wd in line) / fast_scale
+    y0 = min(wd[4] for wd in line) / fast_scale
+    y1 = max(wd[4] + wd[6] for wd in line) / fast_scale
+    pad = (y1 - y0) * REFINE_PAD
+    cx0, cy0 = max(0, int(x0 - pad)), max(0, int(y0 - pad))
+    crop = gray[cy0:min(h, int(y1 + pad) + 1), cx0:min(w, int(x1 + pad) + 1)]
+    f = fast_scale / full_scale
+
+    def to_page(wd):
+        left, top, width, height = wd[3:7]
+        return (round(cx0 * fast_scale + left * f), round(cy0 * fast_scale + top * f),
+                round(width * f), round(height * f))
+
+    best, best_conf = line, mean_confidence(line)
+    for block_size, c in ((settings.get("block_size"), settings.get("c")), ALT_THRESHOLD):
+        words = ocr_data(binarize(crop, full_scale, block_size, c), REFINE_CONFIG)
+        conf = mean_confidence(words)
+        if words and conf > best_conf:
+            best, best_conf = [line[0][:3] + to_page(wd) + wd[7:] for wd in words], conf
+        if best_conf >= LINE_MIN_CONF:
+            break
+    return best
+
+
+def ocr_page_confident(pil_img):
+    """Cheap pass first, escalating only where Tesseract is unsure; returns (source, text, words).
+
+    Source is "fast" (cheap pass accepted), "refined" (low-confidence lines
+    re-read at full size) or "ocr" (whole page re-read at full size).
+    """
+    gray = to_gray(pil_img)
+    settings = ocr_settings(gray)
+    target = settings.get("text_height") or TARGET_TEXT_HEIGHT
+    block_size, c, config = settings.get("block_size"), settings.get("c"), settings.get("config")
+
+    fast_scale = page_scale(gray, target * FAST_TEXT_HEIGHT_RATIO)
+    lines = group_lines(ocr_data(binarize(gray, fast_scale, block_size, c), config))
+    low = [i for i, line in enumerate(lines) if mean_confidence(line) < LINE_MIN_CONF]
+    page_conf = mean_confidence([wd for line in lines for wd in line])
+    if lines and not low and page_conf >= ACCEPT_PAGE_CONF:
+        words = PageWords.from_words([wd for line in lines for wd in line], fast_scale)
+        return "fast", words.text, words
+
+    full_scale = page_scale(gray, target)
+    if not lines or len(low) > MAX_REFINE_LINE_FRACTION * len(lines):
+        words = ocr_words(binarize(gray, full_scale, block_size, c), config, full_scale)
+        return "ocr", words.text, words
+    metrics.count("lines_refined", len(low))
+    for i in low:
+        lines[i] = refine_line(gray, lines[i], fast_scale, full_scale, settings)
+    words = PageWords.from_words([wd for line in lines for wd in line], fast_scale)
+    return "refined", words.text, words
+
+
+def _upright(img):
+    """Apply the EXIF orientation, if any (``exif_transpose`` copies even when there is none)."""
+    from PIL import ImageOps
+
+    return ImageOps.exif_transpose(img) if img.getexif().get(EXIF_ORIENTATION, 1) != 1 else img
+
+
+def _shrink_preview(img):
+    # Reduce in the source mode and convert the small result, so a grayscale
+    # scan never gets a full-size RGB copy. Palette indices can't be averaged
+    # and bilevel / 16-bit images can't be reduced, so those convert first.
+    if img.mode in _REDUCE_VIA:
+        img = img.convert(_REDUCE_VIA[img.mode])
+    # Box-filter integer reduction: a fraction of the cost of a Lanczos thumbnail
+    factor = -(-max(img.size) // PREVIEW_LONG_SIDE)
+    if factor > 1:
+        img = img.reduce(factor)
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+def decode_preview(image_bytes):
+    """Decode only the RGB preview of an image file (e.g. when its OCR text is cached).
+
+    JPEGs are decoded at reduced size by libjpeg; other formats have to be
+    decoded whole but are reduced before any conversion.
+    """
+    from PIL import Image
+
+    with metrics.stage("decode_preview", size=len(image_bytes)):
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.format == "JPEG":
+            img.draft("RGB", (PREVIEW_LONG_SIDE, PREVIEW_LONG_SIDE))
+        return _upright(_shrink_preview(img))
+
+
+def decode_image(image_bytes):
+    """Decode an image file to (RGB preview, (h, w) uint8 grayscale page).
+
+    The full-resolution page is never materialised in RGB. JPEGs are decoded
+    at the size each use needs: the preview (and very large scans, see
+    ``JPEG_DRAFT_LONG_SIDE``) via libjpeg DCT scaling, the page straight to
+    gray by ``cv2.imdecode``. Other formats are decoded once by PIL and
+    converted to gray in C. Raises on unreadable data.
+    """
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    with metrics.stage("decode", size=len(image_bytes)) as span:
+        img = Image.open(io.BytesIO(image_bytes))  # parses the header only
+        if img.format == "JPEG":
+            long_side = max(img.size)
+            gray = None
+            if long_side < 2 * JPEG_DRAFT_LONG_SIDE:
+                # Applies the EXIF orientation itself; None for JPEGs OpenCV can't read
+                gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                f = min(1.0, JPEG_DRAFT_LONG_SIDE / long_side)
+                img.draft("L", (int(img.width * f) + 1, int(img.height * f) + 1))
+                gray = np.asarray(_upright(img).convert("L"))
+                span.set(draft=True)
+            preview = decode_preview(image_bytes)
+        else:
+            img = _upright(img)
+            gray = np.asarray(img if img.mode == "L" else img.convert("L"))
+            preview = _shrink_preview(img)
+        span.set(width=gray.shape[1], height=gray.shape[0])
+    return preview, gray
+
+
+def render_pdf_page(page, dpi):
+    """Render a PDF page straight to an 8-bit grayscale pixmap (no PNG round trip)."""
+    import fitz  # PyMuPDF
+
+    with metrics.stage("pdf_render", dpi=dpi) as span:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        span.set(width=pix.width, height=pix.height)
+    return pix
+
+
+def pixmap_to_gray(pix):
+    """View a grayscale pixmap's samples as a (h, w) uint8 array without copying.
+
+    The array borrows the pixmap's buffer, so it is only valid while ``pix`` is alive.
+    """
+    import numpy as np
+
+    buf = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    return buf.reshape(pix.height, pix.stride)[:, :pix.width]
+
+
+def text_layer_words(page, dpi):
+    """``PageWords`` of a born-digital page's text layer, boxes in pixels at ``dpi``.
+
+    PDFs often put every table cell in a block or line of its own, so words
+    are regrouped into visual lines: a word joins the current line if its
+    vertical centre falls within the line's first word. Boxes are shrunk
+    around their centre to about the ink height an OCR pass would report.
+    """
+    zoom = dpi / 72
+    lines = []
+    for word in sorted(page.get_text("words"), key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        if lines and (word[1] + word[3]) / 2 < lines[-1][0][3]:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    rows = []
+    for line_no, line in enumerate(lines):
+        for x0, y0, x1, y1, text, *_ in sorted(line):
+            height = (y1 - y0) * TEXT_LAYER_INK_HEIGHT
+            top = (y0 + y1 - height) / 2
+            rows.append((1, 1, line_no, x0 * zoom, top * zoom, (x1 - x0) * zoom, height * zoom, 100.0, text))
+    return PageWords.from_words(rows)
+
+
+def render_pdf_preview(page, dpi):
+    """Small RGB rendering of a PDF page for display."""
+    from PIL import Image
+
+    zoom = min(dpi / 72, PREVIEW_LONG_SIDE / max(page.rect.width, page.rect.height))
+    with metrics.stage("pdf_preview"):
+        pix = page.get_pixmap(matrix=(zoom, 0, 0, zoom, 0, 0), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def run_page_job(job, regions=False, confidence=False):
+    """OCR one page job; returns (source, text, PageWords or None for ROI pages)."""
+    source, payload = job
+    if source == "text":
+        return (source, *payload)
+    # PDF pages arrive as pixmaps; keep ``payload`` referenced while its array view is in use
+    image = pixmap_to_gray(payload) if hasattr(payload, "samples_mv") else payload
+    if regions:
+        return ocr_page_regions(image)
+    if confidence:
+        return ocr_page_confident(image)
+    words = ocr_page_words(image)
+    return source, words.text, words
+
+
+def ocr_document(image_bytes, is_pdf=False, pdf_dpi=300, use_text_layer=True, regions=False, confidence=False):
+    """Decode and OCR a document; returns an ``OCRDocument``.
+
+    Each page's source is "text", "ocr", "roi" (only header/totals bands
+    OCR'd, see ``regions``) or "fast" / "refined" (confidence-aware early
+    exit, see ``confidence``). Pages served from the OCR cache keep the
+    source they were first read with, so a cached cheap pass can still be
+    escalated. ``page_words`` holds each page's ``PageWords``, read from
+    the text layer for "text" pages and None for ROI pages. ``preview`` is
+    None when the document can't be decoded.
+    """
+    with metrics.stage("document", is_pdf=is_pdf, size=len(image_bytes)) as span:
+        doc = OCRDocument(*_preprocess_document(image_bytes, is_pdf, pdf_dpi, use_text_layer, regions, confidence))
+        span.set(pages=len(doc.page_sources))
+    metrics.count("documents")
+    for source in doc.page_sources:
+        metrics.count(f"pages_{source}")
+    return doc
+
+
+def preprocess_image_for_ocr(image_bytes, is_pdf=False, pdf_dpi=300, use_text_layer=True, regions=False,
+                             confidence=False):
+    """Return (text, preview image, per-page source); see ``ocr_document``."""
+    doc = ocr_document(image_bytes, is_pdf, pdf_dpi, use_text_layer, regions, confidence)
+    return doc.text, doc.preview, doc.page_sources
+
+
+def _preprocess_document(image_bytes, is_pdf, pdf_dpi, use_text_layer, regions, confidence):
+    try:
+        cache = get_cache()
+        tuned = get_tuned_configs()
+        key = cache_key(
+            image_bytes, is_pdf=is_pdf, dpi=pdf_dpi if is_pdf else None,
+            upscale=(UPSCALE_BELOW, UPSCALE_FACTOR), threshold=(THRESH_BLOCK_SIZE, THRESH_C),
+            scale=(TARGET_TEXT_HEIGHT, MIN_SCALE, MAX_SCALE) if ADAPTIVE_SCALE else None,
+            config=OCR_CONFIG, text_layer=use_text_layer and is_pdf, regions=regions,
+            confidence=(FAST_TEXT_HEIGHT_RATIO, ACCEPT_PAGE_CONF, LINE_MIN_CONF) if confidence else None,
+            render="gray", tuned=tuned.digest if tuned else None,
+        )
+        cached_pages = cache.get(key) if cache else None
+        if cache:
+            metrics.count("cache_hits" if cached_pages is not None else "cache_misses")
+
+        if is_pdf:
+            import fitz  # PyMuPDF
+
+            doc = fitz.open("pdf", image_bytes)
+            if doc.page_count == 0:
+                return "", None, [], []
+            preview_image = render_pdf_preview(doc[0], pdf_dpi)
+
+            # Born-digital pages use their embedded text; only scans are rendered and OCR'd.
+            # Jobs are produced lazily as the OCR pool asks for them, so only the pages
+            # in flight hold a full-resolution bitmap; each is freed once it's OCR'd.
+            def page_jobs():
+                for page in doc:
+                    if use_text_layer:
+                        layer_text = page.get_text()
+                        if has_usable_text_layer(layer_text):
+                            yield "text", (layer_text, text_layer_words(page, pdf_dpi))
+                            continue
+                    yield "ocr", render_pdf_page(page, pdf_dpi)
+            jobs = page_jobs()
+        elif cached_pages is not None:
+            # The page itself isn't needed again, only its preview
+            preview_image = decode_preview(image_bytes)
+            jobs = iter(())
+        else:
+            preview_image, gray = decode_image(image_bytes)
+            jobs = iter([("ocr", gray)])
+
+        if cached_pages is not None:
+            page_sources = [source for source, _, _ in cached_pages]
+            page_texts = [page_text for _, page_text, _ in cached_pages]
+            page_words = [PageWords.from_bytes(blob) if blob else None for _, _, blob in cached_pages]
+        else:
+            results = list(ordered_map(functools.partial(run_page_job, regions=regions, confidence=confidence), jobs))
+            page_sources = [source for source, _, _ in results]
+            page_texts = [page_text for _, page_text, _ in results]
+            page_words = [words for _, _, words in results]
+            if cache:
+                cache.put(key, [(src, t, w.to_bytes() if w is not None else None)
+                                for src, t, w in zip(page_sources, page_texts, page_words)])
+
+        text = "".join(page_text + "\n\n" for page_text in page_texts)
+        return text, preview_image, page_sources, page_words
+
+    except Exception as e:
+        print("Preprocessing Error:", e)
+        return "", None, [], []
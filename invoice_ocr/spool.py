@@ -0,0 +1,229 @@
+"""Lease-based work queue for spreading invoices over several OCR nodes.
+
+Producers ``enqueue`` invoices, either as a path every node can read or with
+the file contents embedded. Workers ``claim`` jobs, which leases them for a
+limited time, and then ``ack`` each one with its result or ``fail`` it with
+an error. Long jobs are kept alive with ``extend``. A job whose lease runs
+out becomes claimable again, for example because its worker crashed or the
+node went away. After ``MAX_ATTEMPTS`` deliveries it is parked as failed, so
+a file that kills workers can't loop forever. Delivery is at-least-once: the
+first ack wins, and later acks of the same job are ignored.
+
+Backends are chosen by URL scheme through ``open_spool``. ``SQLiteSpool``
+needs no running service. Its database file can live on a filesystem shared
+by all nodes, as long as that filesystem supports POSIX locks. Lease
+deadlines are wall-clock times, so node clocks must be kept in sync (NTP).
+"""
+import abc
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+LEASE_SECONDS = 300.0
+MAX_ATTEMPTS = 3
+
+Job = namedtuple("Job", "id ref payload attempts")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    ref TEXT NOT NULL,
+    payload BLOB,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL,
+    result TEXT,
+    enqueued_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, lease_until);
+"""
+
+
+class Spool(abc.ABC):
+    """Backend interface; job states are "pending", "leased", "done" and "failed".
+
+    Every method but ``close`` is abstract, so a backend missing one fails when
+    it is created rather than partway through a batch.
+    """
+
+    @abc.abstractmethod
+    def enqueue(self, refs, payloads=None):
+        """Add jobs; ``payloads`` (file contents, or None per job) parallels ``refs``. Returns the count."""
+
+    @abc.abstractmethod
+    def claim(self, owner, n=1, lease=LEASE_SECONDS):
+        """Lease up to ``n`` claimable jobs to ``owner``; returns a list of Job."""
+
+    @abc.abstractmethod
+    def extend(self, job_ids, owner, lease=LEASE_SECONDS):
+        """Push back the lease deadline of jobs ``owner`` still holds."""
+
+    @abc.abstractmethod
+    def ack(self, job_id, result):
+        """Mark a job done; False if it was already finished (e.g. by a redelivery)."""
+
+    @abc.abstractmethod
+    def fail(self, job_id, error, retry=False):
+        """Mark a job failed, or with ``retry`` put it back while it has attempts left."""
+
+    @abc.abstractmethod
+    def release(self, owner):
+        """Hand every job ``owner`` holds back to the queue without counting the attempt."""
+
+    @abc.abstractmethod
+    def counts(self):
+        """{state: number of jobs}."""
+
+    @abc.abstractmethod
+    def results(self):
+        """Yield (ref, state, result dict) for finished jobs, oldest first."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class SQLiteSpool(Spool):
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Autocommit mode, so claims can take the write lock up front with BEGIN IMMEDIATE.
+        # Deliberately not WAL: its shared-memory index only works for processes on one host.
+        self._conn = sqlite3.connect(str(self.path), timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def enqueue(self, refs, payloads=None):
+        refs = [str(r) for r in refs]
+        payloads = payloads if payloads is not None else [None] * len(refs)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO jobs (ref, payload, enqueued_at) VALUES (?, ?, ?)",
+                    [(ref, payload, now) for ref, payload in zip(refs, payloads)],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(refs)
+
+    def claim(self, owner, n=1, lease=LEASE_SECONDS):
+        now = time.time()
+        with self._lock:
+            # Write lock first: two nodes can't both see a job as claimable
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'failed', finished_at = ?, payload = NULL, result = ? "
+                    "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                    (now, json.dumps({"error": "lease expired on every attempt"}), now, self.max_attempts),
+                )
+                rows = self._conn.execute(
+                    "SELECT id, ref, payload, attempts FROM jobs "
+                    "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT ?",
+                    (now, n),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE jobs SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    [(owner, now + lease, job_id) for job_id, _, _, _ in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [Job(job_id, ref, payload, attempts + 1) for job_id, ref, payload, attempts in rows]
+
+    def extend(self, job_ids, owner, lease=LEASE_SECONDS):
+        job_ids = list(job_ids)
+        if not job_ids:
+            return 0
+        marks = ",".join("?" * len(job_ids))
+        return self._write(
+            f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND state = 'leased' AND id IN ({marks})",
+            (time.time() + lease, owner, *job_ids),
+        )
+
+    def ack(self, job_id, result):
+        return self._write(
+            "UPDATE jobs SET state = 'done', result = ?, finished_at = ?, payload = NULL "
+            "WHERE id = ? AND state = 'leased'",
+            (json.dumps(result), time.time(), job_id),
+        ) == 1
+
+    def fail(self, job_id, error, retry=False):
+        if retry and self._write(
+            "UPDATE jobs SET state = 'pending', owner = NULL, lease_until = NULL "
+            "WHERE id = ? AND state = 'leased' AND attempts < ?",
+            (job_id, self.max_attempts),
+        ):
+            return True
+        return self._write(
+            "UPDATE jobs SET state = 'failed', result = ?, finished_at = ?, payload = NULL "
+            "WHERE id = ? AND state = 'leased'",
+            (json.dumps({"error": str(error)}), time.time(), job_id),
+        ) == 1
+
+    def release(self, owner):
+        return self._write(
+            "UPDATE jobs SET state = 'pending', owner = NULL, lease_until = NULL, attempts = attempts - 1 "
+            "WHERE owner = ? AND state = 'leased'",
+            (owner,),
+        )
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = dict.fromkeys(("pending", "leased", "done", "failed"), 0)
+        counts.update(rows)
+        return counts
+
+    def results(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ref, state, result FROM jobs WHERE state IN ('done', 'failed') ORDER BY finished_at, id"
+            ).fetchall()
+        for ref, state, result in rows:
+            yield ref, state, json.loads(result)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS = {"sqlite": SQLiteSpool}
+
+
+def register_backend(scheme, factory):
+    """Make ``open_spool("scheme://...")`` call ``factory(rest_of_url)``."""
+    BACKENDS[scheme] = factory
+
+
+def open_spool(url):
+    """Open a spool by URL: ``sqlite:///shared/spool.sqlite3``; a bare path means SQLite."""
+    scheme, sep, rest = str(url).partition("://")
+    if not sep:
+        return SQLiteSpool(url)
+    if scheme not in BACKENDS:
+        raise ValueError(f"unknown spool backend {scheme!r} (known: {', '.join(sorted(BACKENDS))})")
+    # sqlite:///abs/path keeps its leading slash, sqlite://rel/path is relative
+    return BACKENDS[scheme](rest)
@@ -0,0 +1,178 @@
+"""Vendor templates and the fingerprint index that routes documents to them.
+
+A template carries a few header markers (strings printed on every invoice of
+that vendor) and its own compiled field rules. Routing looks only at the
+first ``FINGERPRINT_LINES`` lines: their distinctive tokens are hashed and
+looked up in an inverted index, and only the few templates sharing the most
+tokens are confirmed with a fuzzy match (thefuzz) against their markers, so
+lookup cost barely grows with the number of templates.
+
+Extra templates can be loaded from a JSON file named by
+``INVOICE_OCR_TEMPLATES``::
+
+    [{"name": "acme", "markers": ["ACME SUPPLIES", "Remit To"],
+      "rules": [["Invoice Number", "id", "Invoice\\\\s+No\\\\s*:\\\\s*(\\\\d+)"]]}]
+"""
+import json
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+
+FINGERPRINT_LINES = 8
+FINGERPRINT_TOKENS = 16
+# Index candidates confirmed with the fuzzy matcher, best token overlap first
+MAX_CANDIDATES = 5
+MIN_SHARED_TOKENS = 2
+MATCH_THRESHOLD = 85  # thefuzz token_set_ratio, 0..100
+
+TOKEN_RE = re.compile(r'[a-z]{3,}')
+# Words printed on nearly every invoice carry no vendor information
+COMMON_TOKENS = frozenset({
+    "invoice", "tax", "bill", "date", "number", "order", "total", "amount",
+    "the", "and", "for", "with", "from", "address", "original", "recipient",
+    "copy", "page", "limited", "private", "pvt", "ltd", "inc", "llc",
+})
+
+# Rule kinds: "id" (upper-cased), "date" / "date_dmy" (parsed to YYYY-MM-DD,
+# the latter reading 01.02.2024 as 1 February), "text", "words" (amount in
+# words) and "amount" (numeric, thousands separators allowed)
+RULE_KINDS = ("id", "date", "date_dmy", "text", "words", "amount")
+
+
+def tokens(text):
+    """Distinctive lowercase tokens of ``text``, in order of first appearance."""
+    seen = {}
+    for tok in TOKEN_RE.findall(text.lower()):
+        if tok not in COMMON_TOKENS:
+            seen.setdefault(tok, None)
+    return list(seen)
+
+
+def token_hash(tok):
+    return zlib.crc32(tok.encode("utf-8"))
+
+
+def fingerprint(lines):
+    """Hashes of the first distinctive header tokens of a document."""
+    header = " ".join(lines[:FINGERPRINT_LINES])
+    return [token_hash(t) for t in tokens(header)[:FINGERPRINT_TOKENS]], header
+
+
+class VendorTemplate:
+    """One vendor's header markers and field rules.
+
+    ``rules`` is a list of (field, kind, pattern); the first rule that matches
+    a field wins, so put the most precise pattern for a field first.
+    """
+
+    def __init__(self, name, markers, rules):
+        self.name = name
+        self.markers = tuple(markers)
+        self.marker_text = " ".join(self.markers)
+        self.rules = []
+        for field, kind, pattern in rules:
+            if kind not in RULE_KINDS:
+                raise ValueError(f"template {name!r}: unknown rule kind {kind!r}")
+            if isinstance(pattern, str):
+                pattern = re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+            self.rules.append((field, kind, pattern))
+        self.token_hashes = [token_hash(t) for t in tokens(self.marker_text)]
+        if not self.token_hashes:
+            raise ValueError(f"template {name!r}: markers have no distinctive tokens")
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec["name"], spec["markers"], spec["rules"])
+
+    def __repr__(self):
+        return f"VendorTemplate({self.name!r})"
+
+
+class TemplateRegistry:
+    def __init__(self, templates=()):
+        self.templates = []
+        self._index = {}  # token hash -> [template index]
+        for template in templates:
+            self.add(template)
+
+    def add(self, template):
+        idx = len(self.templates)
+        self.templates.append(template)
+        for h in set(template.token_hashes):
+            self._index.setdefault(h, []).append(idx)
+
+    def load_json(self, path):
+        with open(path, encoding="utf-8") as f:
+            for spec in json.load(f):
+                self.add(VendorTemplate.from_dict(spec))
+
+    def __len__(self):
+        return len(self.templates)
+
+    def match(self, lines):
+        """The template whose markers appear in the document header, or None."""
+        hashes, header = fingerprint(lines)
+        votes = Counter()
+        for h in hashes:
+            for idx in self._index.get(h, ()):
+                votes[idx] += 1
+        if not votes:
+            return None
+
+        from thefuzz import fuzz
+
+        for idx, shared in votes.most_common(MAX_CANDIDATES):
+            template = self.templates[idx]
+            if shared < min(MIN_SHARED_TOKENS, len(template.token_hashes)):
+                break
+            if fuzz.token_set_ratio(template.marker_text, header) >= MATCH_THRESHOLD:
+                return template
+        return None
+
+
+DATE_VALUE = r'(\d{1,4}[\.\/\s-]+[A-Za-z0-9]{2,10}[\.\/\s-]+\d{1,4})'
+
+BUILTIN_TEMPLATES = [
+    VendorTemplate(
+        "amazon",
+        markers=["Tax Invoice/Bill of Supply/Cash Memo", "Sold By"],
+        rules=[
+            ("Invoice Number", "id", r'Invoice\s+Number\s*[:-]?\s*([A-Za-z0-9\-]+)'),
+            ("Order ID", "id", r'Order\s+(?:Number|No|ID?|td)\s*[:\-]?\s*([0-9][0-9\-]+)'),
+            ("Invoice Date", "date_dmy", r'Invoice\s+Date\s*[:-]?\s*' + DATE_VALUE),
+            ("Order Date", "date_dmy", r'Order\s+Date\s*[:-]?\s*' + DATE_VALUE),
+            # Seller on the line after "Sold By:", cut where the billing address column starts
+            ("Vendor Name", "text", r'Sold\s+By\s*:?\s*\n\s*(.+?)(?=\s{2,}|\s+[_|]|\s*Billing\s+Address|\s*$)'),
+            ("Total Amount", "words", r'Amount\s+in\s+Words\s*:?\s*([A-Za-z][A-Za-z \-]*?\bonly)\b'),
+            ("Total Amount", "amount", r'^\s*TOTAL\s*:?\s*\|?\s*(?:Rs\.?|₹)\s*(\d[\d,]*(?:\.\d{1,2})?)'),
+        ],
+    ),
+    VendorTemplate(
+        "zomato",
+        markers=["ZOMATO"],
+        rules=[
+            ("Vendor Name", "text", r'^\W*(zomato\s+(?:private\s+)?limited)'),
+            ("Order ID", "id", r'Order\s+(?:ID?|td)\s*[:\-]?\s*(\d+)'),
+            ("Invoice Date", "date_dmy", r'Invoice\s+Date\s*[:-]?\s*' + DATE_VALUE),
+            ("Total Amount", "words", r'Total\s+Amount\s*:\s*(Indian\s+Rupee.+?paisa\s+only)'),
+        ],
+    ),
+]
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Process-wide registry: built-in templates plus ``INVOICE_OCR_TEMPLATES``, if set."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            registry = TemplateRegistry(BUILTIN_TEMPLATES)
+            path = os.environ.get("INVOICE_OCR_TEMPLATES")
+            if path:
+                registry.load_json(path)
+            _registry = registry
+        return _registry
@@ -0,0 +1,62 @@
+"""Tuned per-layout OCR settings written by ``tune.py`` and looked up at runtime.
+
+The file maps each layout cluster (``layout.layout_cluster``: sparse receipts,
+multi-column pages, dense single-column pages) to the fastest Tesseract
+config and preprocessing that met the accuracy bar on labelled samples::
+
+    {"version": 1,
+     "clusters": {"sparse": {"config": "--oem 3 --psm 11", "block_size": 31,
+                             "c": 2, "text_height": 24}, ...},
+     "vendors": {...}}   # per-vendor results, for reference only
+
+Set ``INVOICE_OCR_TUNED`` to the file to use it; without it every page gets
+the module defaults from ``preprocess``.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+TUNED_VERSION = 1
+SETTING_KEYS = ("config", "block_size", "c", "text_height")
+
+
+class TunedConfigs:
+    def __init__(self, path):
+        self.path = Path(path)
+        raw = self.path.read_bytes()
+        data = json.loads(raw)
+        if data.get("version") != TUNED_VERSION:
+            raise ValueError(f"{path}: unsupported tuned config version {data.get('version')!r}")
+        self.clusters = {
+            name: {k: v for k, v in settings.items() if k in SETTING_KEYS}
+            for name, settings in data.get("clusters", {}).items()
+        }
+        # Part of the OCR cache key: retuning must not serve text read with old settings
+        self.digest = hashlib.sha256(raw).hexdigest()[:16]
+
+    def lookup(self, cluster):
+        """Settings for a layout cluster; empty when it wasn't tuned."""
+        return self.clusters.get(cluster, {})
+
+
+def save_tuned(path, clusters, vendors=None):
+    data = {"version": TUNED_VERSION, "clusters": clusters, "vendors": vendors or {}}
+    Path(path).write_text(json.dumps(data, indent=2, sort_keys=True), encoding="utf-8")
+
+
+_tuned = None
+_tuned_loaded = False
+_tuned_lock = threading.Lock()
+
+
+def get_tuned_configs():
+    """The configs named by ``INVOICE_OCR_TUNED``, loaded once, or None."""
+    global _tuned, _tuned_loaded
+    with _tuned_lock:
+        if not _tuned_loaded:
+            path = os.environ.get("INVOICE_OCR_TUNED")
+            _tuned = TunedConfigs(path) if path else None
+            _tuned_loaded = True
+        return _tuned
@@ -0,0 +1,107 @@
+"""Columnar OCR output: every recognised word of a page with its box and confidence.
+
+One ``image_to_data`` pass gives the word geometry. ``PageWords`` keeps it as
+a few numpy columns over a single text buffer. Each word is a slice
+``text[start:end]`` of the page's plain text, which is laid out the way
+Tesseract lays out plain text (see ``from_words``). It is not guaranteed to
+be byte-for-byte what ``image_to_string`` returns: the CLI backend also ends
+pages with a form feed, and whitespace-only words are dropped.
+``extract_fields`` reads ``words.text`` at no extra cost, while line items,
+confidences and regions come from the same pass. Boxes are in pixels of the
+page as decoded, before OCR scaling.
+"""
+
+# Column order of ``PageWords.ints``
+INT_COLUMNS = ("start", "end", "left", "top", "width", "height", "block", "par", "line")
+_HEADER_BYTES = 4
+
+
+class PageWords:
+    __slots__ = ("text", "ints", "conf")
+
+    def __init__(self, text, ints, conf):
+        self.text = text
+        self.ints = ints  # (n, len(INT_COLUMNS)) int32
+        self.conf = conf  # (n,) float32, 0-100
+
+    @classmethod
+    def from_words(cls, words, scale=1.0):
+        """Build from ``engine.parse_tsv`` rows read from an image scaled by ``scale``.
+
+        The text is rebuilt the way Tesseract lays out plain text: words joined
+        by spaces, lines by newlines, paragraphs by a blank line.
+        """
+        import numpy as np
+
+        parts, rows, conf = [], [], []
+        pos = 0
+        prev = None
+        for block, par, line, left, top, width, height, word_conf, word in words:
+            if prev is not None:
+                sep = "\n\n" if (block, par) != prev[:2] else "\n" if line != prev[2] else " "
+                parts.append(sep)
+                pos += len(sep)
+            parts.append(word)
+            rows.append((pos, pos + len(word), left, top, width, height, block, par, line))
+            conf.append(word_conf)
+            pos += len(word)
+            prev = (block, par, line)
+        if parts:
+            parts.append("\n")
+
+        ints = np.array(rows, dtype=np.float64).reshape(-1, len(INT_COLUMNS))
+        if scale != 1.0:
+            ints[:, 2:6] /= scale
+        return cls("".join(parts), np.rint(ints).astype(np.int32), np.array(conf, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.conf)
+
+    def word(self, i):
+        start, end = self.ints[i, :2]
+        return self.text[start:end]
+
+    def lines(self):
+        """Index arrays of the words on each text line, in reading order."""
+        import numpy as np
+
+        if not len(self):
+            return []
+        keys = self.ints[:, 6:9]
+        breaks = np.flatnonzero((keys[1:] != keys[:-1]).any(axis=1)) + 1
+        return np.split(np.arange(len(self)), breaks)
+
+    def mean_confidence(self, idx=None):
+        """Character-weighted mean confidence (0-100) of all words or of those at ``idx``."""
+        ints = self.ints if idx is None else self.ints[idx]
+        conf = self.conf if idx is None else self.conf[idx]
+        chars = ints[:, 1] - ints[:, 0]
+        return float((conf * chars).sum() / chars.sum()) if chars.sum() else 0.0
+
+    def to_bytes(self):
+        """Compact serialisation for the OCR cache: row count, int columns, confidences, UTF-8 text."""
+        import numpy as np
+
+        n = np.array([len(self)], dtype="<u4")
+        return (n.tobytes() + self.ints.astype("<i4").tobytes()
+                + self.conf.astype("<f4").tobytes() + self.text.encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data):
+        import numpy as np
+
+        n = int(np.frombuffer(data, dtype="<u4", count=1)[0])
+        ints_end = _HEADER_BYTES + n * len(INT_COLUMNS) * 4
+        ints = np.frombuffer(data, dtype="<i4", count=n * len(INT_COLUMNS), offset=_HEADER_BYTES)
+        conf = np.frombuffer(data, dtype="<f4", count=n, offset=ints_end)
+        text = bytes(data[ints_end + n * 4:]).decode("utf-8")
+        return cls(text, ints.reshape(n, len(INT_COLUMNS)), conf)
+
+
+def _column(i):
+    return property(lambda self: self.ints[:, i])
+
+
+# words.left, words.top, ... are views into ``ints``
+for _i, _name in enumerate(INT_COLUMNS):
+    setattr(PageWords, _name, _column(_i))
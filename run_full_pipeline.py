@@ -1,82 +1,401 @@
-import sys
-from pathlib import Path
-from PIL import Image
-import pytesseract
-import re
-import json
-import dateparser  
-
-
-if len(sys.argv) > 1:
-    IMG_PATH = Path(sys.argv[1])
-else:
-    IMG_PATH = Path("invoice_clean.jpg")
-
-try:
-    img = Image.open(IMG_PATH).convert("RGB")
-except Exception as e:
-    raise SystemExit(f"Cannot open image: {e}")
-
-text = pytesseract.image_to_string(img, config="--oem 3 --psm 6")
-
-lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-
-invoice_no = ""
-date_value = ""
-vendor = ""
-total_amount = ""
-total_amount_numeric = ""
-account_no = ""
-
-for ln in lines:
-    m = re.search(r'Invoice\s*#?\s*(\d+)', ln, re.I)
-    if m:
-        invoice_no = m.group(1)
-        break
-
-for ln in lines:
-    if "invoice" in ln.lower() and "date" in ln.lower():
-        date_candidate = re.findall(r'\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}', ln)
-        if date_candidate:
-            dp = dateparser.parse(date_candidate[0])
-            if dp:
-                date_value = dp.strftime("%Y-%m-%d")
-                break
-
-for ln in lines:
-    if re.search(r'\btotal\b', ln, re.I):
-        m = re.search(r'\$?\s*([\d,.]+)', ln)
-        if m:
-            total_amount_numeric = m.group(1).replace(",", "")
-            total_amount = "$" + total_amount_numeric
-            break
-
-for ln in lines:
-    m = re.search(r'\b\d{3}-\d{3}-\d{4}\b', ln)
-    if m:
-        account_no = m.group()
-        break
-
-for ln in lines[:5]:
-    if not re.search(r'\d', ln) and len(ln.split()) <= 4:
-        vendor = ln
-        break
-
-output = {
-    "invoice_number": invoice_no,
-    "invoice_date": date_value,
-    "vendor": vendor,
-    "total_amount": total_amount,
-    "total_amount_numeric": total_amount_numeric,
-    "account_number": account_no,
-    "raw_lines_count": len(lines)
-}
-
-print(json.dumps(output, indent=2))
-
-out_file = f"invoice_output_{IMG_PATH.stem}.json"
-with open(out_file, "w", encoding="utf-8") as f:
-    json.dump(output, f, indent=2)
-
-print(f"SAVED_JSON: {Path(out_file).resolve()}")
-
+import sys
+import os
+import glob
+import time
+import socket
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import json
+from collections import Counter
+
+from invoice_ocr import metrics, pipeline
+from invoice_ocr.dedupe import DuplicateIndex, exact_key, signature
+from invoice_ocr.journal import Journal, file_digest
+from invoice_ocr.pipeline import init_worker, process_document_measured
+from invoice_ocr.spool import LEASE_SECONDS, open_spool
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".pdf"}
+MANIFEST_EXTENSIONS = {".txt", ".lst"}
+
+
+def to_output(data, text, line_items=()):
+    """Map extract_fields' card labels onto the JSON keys the UiPath workflow reads."""
+    def value(field):
+        return "" if data[field] == "Not found" else data[field]
+
+    total_amount = value("Total Amount")
+    return {
+        "invoice_number": value("Invoice Number"),
+        "order_id": value("Order ID"),
+        "invoice_date": value("Invoice Date"),
+        "order_date": value("Order Date"),
+        "due_date": value("Due Date"),
+        "vendor": value("Vendor Name"),
+        "total_amount": total_amount,
+        "total_amount_numeric": total_amount.split()[-1] if total_amount else "",
+        "total_amount_confidence": value("Total Amount Confidence"),
+        "account_number": value("Account Number"),
+        "line_items": list(line_items),
+        "raw_lines_count": sum(1 for ln in text.splitlines() if ln.strip()),
+    }
+
+
+def process_image(img_path, data=None):
+    """Return (output record, OCR text, page sources, metrics snapshot or None) for one invoice file.
+
+    ``data`` is the file's content when it was shipped separately (spool jobs with embedded files).
+    """
+    img_path = Path(img_path)
+    (fields, text, page_sources, line_items), snap = process_document_measured(
+        img_path.read_bytes() if data is None else data, is_pdf=img_path.suffix.lower() == ".pdf"
+    )
+    return to_output(fields, text, line_items), text, page_sources, snap
+
+
+# ==========================================
+# BATCH MODE
+# ==========================================
+def collect_inputs(spec):
+    """Expand a directory, glob pattern or manifest file into a list of invoice paths."""
+    path = Path(spec)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if path.is_file() and path.suffix.lower() in MANIFEST_EXTENSIONS:
+        # One path per line; relative entries are resolved against the manifest's folder
+        inputs = []
+        for ln in path.read_text(encoding="utf-8").splitlines():
+            ln = ln.strip()
+            if not ln or ln.startswith("#"):
+                continue
+            entry = Path(ln)
+            inputs.append(entry if entry.is_absolute() else path.parent / entry)
+        return inputs
+    if any(ch in spec for ch in "*?["):
+        return sorted(Path(p) for p in glob.glob(spec, recursive=True)
+                      if Path(p).suffix.lower() in IMAGE_EXTENSIONS)
+    return [path]
+
+
+def process_batch_item(img_path, dedupe=False, data=None):
+    try:
+        result, text, page_sources, snap = process_image(img_path, data)
+    except Exception as e:
+        return {"file": str(img_path), "error": str(e)}
+    # Private keys are shipped back to the parent and used there; never written to the output
+    item = {"file": str(img_path), **result, "_page_sources": page_sources}
+    if snap is not None:
+        item["_metrics"] = snap
+    if dedupe:
+        item["_signature"] = signature(text)
+    return item
+
+
+def pending_inputs(inputs, journal, skipped):
+    """Yield (path, content hash, earlier path with the same content or None) for inputs to handle.
+
+    Inputs the journal has already recorded are only added to ``skipped``.
+    A byte-identical copy of an earlier input in this batch is yielded with
+    that input's path, so it gets an output line without being OCR'd again.
+    """
+    first_seen = {}
+    for img_path in inputs:
+        if journal is None:
+            yield img_path, None, None
+            continue
+        try:
+            digest = file_digest(img_path)
+        except OSError:
+            # Let the worker report the unreadable file like any other failure
+            yield img_path, None, None
+            continue
+        if journal.has(digest):
+            skipped.append(img_path)
+            continue
+        if digest in first_seen:
+            skipped.append(img_path)
+            yield img_path, digest, first_seen[digest]
+            continue
+        first_seen[digest] = img_path
+        yield img_path, digest, None
+
+
+def copy_record(img_path, duplicate_of, dedupe=False):
+    """Output line for an input whose bytes are identical to an earlier input of the batch."""
+    record = {"file": str(img_path), "duplicate_of": str(duplicate_of)}
+    if dedupe:
+        record["duplicates"] = [{"ref": str(duplicate_of), "reason": "exact", "similarity": 1.0}]
+    return record
+
+
+def run_batch(inputs, out, workers=None, journal=None, dedupe=None):
+    """Process invoices in a worker pool, writing one JSON line per result as each finishes.
+
+    With a journal, inputs whose content was already processed are skipped and
+    every new success is checkpointed; byte-identical copies within the batch
+    are skipped too, but get a ``duplicate_of`` line. With a DuplicateIndex each result gets a
+    ``duplicates`` list of earlier invoices (this batch or history) it matches.
+    Returns (failed, skipped, Counter of page sources).
+    """
+    workers = workers or os.cpu_count() or 1
+    # Keep only a small window of jobs in flight so huge manifests don't queue up every future
+    max_pending = workers * 4
+    pending = {}
+    failed = 0
+    skipped = []
+    sources = Counter()
+    it = pending_inputs(inputs, journal, skipped)
+
+    # Each worker loads its Tesseract engine once, up front, and reuses it for every invoice
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        while True:
+            for img_path, digest, duplicate_of in it:
+                if duplicate_of is not None:
+                    out.write(json.dumps(copy_record(img_path, duplicate_of, dedupe is not None)) + "\n")
+                    continue
+                pending[pool.submit(process_batch_item, img_path, dedupe is not None)] = digest
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                digest = pending.pop(fut)
+                result = fut.result()
+                sources.update(result.pop("_page_sources", ()))
+                snap = result.pop("_metrics", None)
+                if snap is not None:
+                    metrics.merge(snap)
+                if dedupe is not None and "error" not in result:
+                    key = exact_key(result["vendor"], result["invoice_number"], result["total_amount_numeric"])
+                    result["duplicates"] = dedupe.check(result["file"], key, result.pop("_signature"))
+                if "error" in result:
+                    failed += 1
+                elif journal is not None and digest is not None:
+                    journal.record(digest, result["file"], result)
+                out.write(json.dumps(result) + "\n")
+            out.flush()
+    return failed, len(skipped), sources
+
+
+# ==========================================
+# SPOOL MODE (several nodes sharing one queue)
+# ==========================================
+# How often a worker renews the leases of the jobs it holds, as a fraction of the lease
+HEARTBEAT_FRACTION = 1 / 3
+IDLE_POLL_SECONDS = 2.0
+
+
+def enqueue_inputs(spool, inputs, embed=False):
+    """Queue invoices by absolute path, or with ``embed`` by content (nodes need no shared storage)."""
+    refs = [Path(p).resolve() for p in inputs]
+    payloads = [p.read_bytes() for p in refs] if embed else None
+    return spool.enqueue(refs, payloads)
+
+
+def run_worker(spool, out, workers=None, lease=LEASE_SECONDS):
+    """Claim and process spool jobs until nothing is pending or leased anywhere.
+
+    Jobs leased by other nodes keep this worker polling, so it picks them up
+    if their leases expire. Returns (processed, failed, Counter of page sources).
+    """
+    workers = workers or os.cpu_count() or 1
+    # Claimed jobs are unavailable to other nodes, so only a short local backlog is held
+    max_pending = workers * 2
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    pending = {}
+    processed = failed = 0
+    sources = Counter()
+    heartbeat = lease * HEARTBEAT_FRACTION
+    next_heartbeat = time.monotonic() + heartbeat
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        try:
+            while True:
+                if len(pending) < max_pending:
+                    for job in spool.claim(owner, max_pending - len(pending), lease):
+                        fut = pool.submit(process_batch_item, job.ref, False, job.payload)
+                        pending[fut] = job
+                if not pending:
+                    counts = spool.counts()
+                    if not counts["pending"] and not counts["leased"]:
+                        break
+                    time.sleep(IDLE_POLL_SECONDS)
+                    continue
+                done, _ = wait(pending, timeout=heartbeat, return_when=FIRST_COMPLETED)
+                if time.monotonic() >= next_heartbeat:
+                    spool.extend([job.id for job in pending.values()], owner, lease)
+                    next_heartbeat = time.monotonic() + heartbeat
+                for fut in done:
+                    job = pending.pop(fut)
+                    result = fut.result()
+                    sources.update(result.pop("_page_sources", ()))
+                    snap = result.pop("_metrics", None)
+                    if snap is not None:
+                        metrics.merge(snap)
+                    processed += 1
+                    if "error" in result:
+                        failed += 1
+                        spool.fail(job.id, result["error"])
+                    else:
+                        spool.ack(job.id, result)
+                    out.write(json.dumps(result) + "\n")
+                out.flush()
+        finally:
+            # Interrupted (Ctrl+C, error): give unfinished jobs straight back instead of
+            # leaving them to time out
+            if pending:
+                spool.release(owner)
+    return processed, failed, sources
+
+
+def collect_results(spool, out):
+    """Write every finished job's result as a JSON line; returns (done, failed)."""
+    done = failed = 0
+    for ref, state, result in spool.results():
+        if state == "failed":
+            failed += 1
+        else:
+            done += 1
+        out.write(json.dumps({"file": ref, **result}) + "\n")
+    return done, failed
+
+
+def run_single(img_path):
+    try:
+        output = process_image(img_path)[0]
+    except Exception as e:
+        raise SystemExit(f"Cannot open image: {e}")
+
+    print(json.dumps(output, indent=2))
+
+    out_file = f"invoice_output_{img_path.stem}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+
+    print(f"SAVED_JSON: {Path(out_file).resolve()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract invoice fields from one image or a whole batch.")
+    parser.add_argument("input", nargs="?", default="invoice_clean.jpg",
+                        help="image file, directory, glob pattern or manifest (.txt/.lst, one path per line)")
+    parser.add_argument("-o", "--output", help="write batch results as JSON lines to this file instead of stdout")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="record per-stage timings and counters and write them here in Prometheus text format")
+    parser.add_argument("--metrics-log", action="store_true",
+                        help="also log every finished stage as a JSON line on stderr")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="SQLite checkpoint journal; inputs already recorded there (by content hash) are skipped")
+    parser.add_argument("--dedupe", metavar="FILE",
+                        help="SQLite duplicate index; flags invoices matching earlier ones in this batch or any previous run")
+    parser.add_argument("--roi", action="store_true",
+                        help="OCR only header/totals regions first, whole pages only when fields are missing")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="accept a cheap OCR pass where Tesseract is confident; re-read only doubtful lines/pages")
+    parser.add_argument("--spool", metavar="URL",
+                        help="shared job queue (SQLite file or sqlite:///path); with INPUT, queue the invoices")
+    parser.add_argument("--embed", action="store_true",
+                        help="with --spool, queue file contents instead of paths (workers need no shared storage)")
+    parser.add_argument("--worker", action="store_true",
+                        help="with --spool, process queued invoices until the queue is drained")
+    parser.add_argument("--collect", action="store_true",
+                        help="with --spool, write the results of all finished jobs")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                        help="seconds a claimed job stays reserved without a heartbeat before it is redelivered")
+    args = parser.parse_args(argv)
+
+    if args.early_exit:
+        os.environ["INVOICE_OCR_EARLY_EXIT"] = "1"
+        pipeline.EARLY_EXIT_ENABLED = True
+    if args.roi:
+        os.environ["INVOICE_OCR_ROI"] = "1"
+        pipeline.ROI_ENABLED = True
+
+    if args.metrics or args.metrics_log:
+        # Set through the environment too, so spawned workers (Windows) pick it up
+        os.environ["INVOICE_OCR_METRICS"] = "log" if args.metrics_log else "1"
+        metrics.enable()
+        if args.metrics_log:
+            metrics.log_to_stderr()
+
+    try:
+        run(args)
+    finally:
+        if args.metrics:
+            with open(args.metrics, "w", encoding="utf-8") as f:
+                f.write(metrics.render_prometheus())
+
+
+def run_spool(args):
+    spool = open_spool(args.spool)
+    try:
+        if args.worker or args.collect:
+            out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+            try:
+                if args.worker:
+                    processed, failed, _ = run_worker(spool, out, args.workers, args.lease)
+                    print(f"PROCESSED: {processed} FAILED: {failed}", file=sys.stderr)
+                else:
+                    done, failed = collect_results(spool, out)
+                    print(f"COLLECTED: {done} FAILED: {failed}", file=sys.stderr)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        else:
+            inputs = collect_inputs(args.input)
+            if not inputs:
+                raise SystemExit(f"No invoices found for: {args.input}")
+            print(f"ENQUEUED: {enqueue_inputs(spool, inputs, args.embed)}", file=sys.stderr)
+        counts = spool.counts()
+        print("QUEUE: " + " ".join(f"{state}={n}" for state, n in counts.items()), file=sys.stderr)
+    finally:
+        spool.close()
+
+
+def run(args):
+    if args.spool:
+        run_spool(args)
+        return
+    path = Path(args.input)
+    is_batch = (path.is_dir() or path.suffix.lower() in MANIFEST_EXTENSIONS
+                or any(ch in args.input for ch in "*?["))
+    if not is_batch and not args.output and not args.journal and not args.dedupe:
+        run_single(path)
+        return
+
+    inputs = collect_inputs(args.input)
+    if not inputs:
+        raise SystemExit(f"No invoices found for: {args.input}")
+
+    journal = Journal(args.journal) if args.journal else None
+    dedupe = DuplicateIndex(args.dedupe) if args.dedupe else None
+    try:
+        if args.output:
+            # A resumed run adds to the results of the earlier attempts
+            with open(args.output, "a" if journal else "w", encoding="utf-8") as out:
+                failed, skipped, sources = run_batch(inputs, out, args.workers, journal, dedupe)
+        else:
+            failed, skipped, sources = run_batch(inputs, sys.stdout, args.workers, journal, dedupe)
+    finally:
+        if journal is not None:
+            journal.close()
+        if dedupe is not None:
+            dedupe.close()
+
+    print(f"PROCESSED: {len(inputs) - skipped} FAILED: {failed} SKIPPED: {skipped}", file=sys.stderr)
+    if args.early_exit:
+        # Pages that needed more than the cheap pass (whole-page "ocr" includes documents
+        # that fell back because a required field was missing). Cache hits report the
+        # source they were first read with, so they count like a fresh run.
+        ocr_pages = sum(n for src, n in sources.items() if src != "text")
+        escalated = sources["refined"] + sources["ocr"]
+        rate = escalated / ocr_pages if ocr_pages else 0.0
+        print(f"ESCALATED: {escalated}/{ocr_pages} pages ({rate:.1%}) "
+              f"refined={sources['refined']} full={sources['ocr']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import os
+import asyncio
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from aiohttp import web
+
+from invoice_ocr import metrics
+from invoice_ocr.pipeline import init_worker, process_document_measured
+
+INDEX_HTML = Path(__file__).with_name("index.html")
+UPLOAD_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".pdf"}
+MAX_FILE_BYTES = 25 * 1024 * 1024
+READ_CHUNK = 256 * 1024
+
+
+class Busy(Exception):
+    pass
+
+
+# ==========================================
+# EXTRACTION SERVICE
+# ==========================================
+class Admission:
+    """Queue places held for one request's documents until each of them gets a worker slot."""
+
+    def __init__(self, service, n):
+        self.service = service
+        self.held = n
+
+    def take(self):
+        self.held -= 1
+        self.service.waiting -= 1
+
+    def release(self):
+        """Give back the places of documents that never reached the pool (timeout, error)."""
+        self.service.waiting -= self.held
+        self.held = 0
+
+
+class ExtractionService:
+    """Runs preprocess+OCR+extract in a process pool with bounded admission.
+
+    At most ``max_inflight`` documents are in the pool at once; up to
+    ``max_queue`` more may wait for a slot, anything beyond that is rejected
+    straight away so the load balancer can retry elsewhere. A request's
+    documents are admitted all together or not at all.
+    """
+
+    def __init__(self, workers, max_inflight, max_queue, timeout):
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.capacity = max_inflight + max_queue
+        self.timeout = timeout
+        self.waiting = 0
+        self.inflight = 0
+
+    def admit(self, n):
+        """Reserve places for ``n`` documents at once; raises Busy unless all of them fit now."""
+        if self.inflight + self.waiting + n > self.capacity:
+            raise Busy()
+        self.waiting += n
+        return Admission(self, n)
+
+    def _job_done(self, fut):
+        # Slots are released when the worker finishes, not when the client gives up,
+        # so timed-out requests can't push more work into the pool than it has slots
+        self.inflight -= 1
+        self.slots.release()
+        if not fut.cancelled():
+            fut.exception()
+
+    async def extract(self, file_bytes, is_pdf, admission):
+        await self.slots.acquire()
+        admission.take()
+        self.inflight += 1
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.pool, process_document_measured, file_bytes, is_pdf)
+        fut.add_done_callback(self._job_done)
+        (fields, _, page_sources, line_items), snap = await asyncio.shield(fut)
+        if snap is not None:
+            metrics.merge(snap)
+        return fields, page_sources, line_items
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def to_response_data(fields, page_sources, line_items=()):
+    """Shape extract_fields output the way index.html renders it."""
+    def value(field):
+        return None if fields[field] == "Not found" else fields[field]
+
+    found = sum(1 for k, v in fields.items() if v != "Not found" and k != "Total Amount Confidence")
+    total = value("Total Amount")
+    total_confidence = value("Total Amount Confidence")
+    return {
+        "invoice_number": value("Invoice Number"),
+        "invoice_date": value("Invoice Date"),
+        "due_date": value("Due Date"),
+        "po_number": value("Order ID"),
+        "order_date": value("Order Date"),
+        "account_number": value("Account Number"),
+        "vendor": {"name": value("Vendor Name")},
+        "bill_to": {},
+        "line_items": list(line_items),
+        "currency": "INR" if total else None,
+        "total": total,
+        "total_confidence": float(total_confidence) if total_confidence else None,
+        "confidence": "high" if found >= 5 else "medium" if found >= 3 else "low",
+        "page_sources": page_sources,
+    }
+
+
+# ==========================================
+# HTTP HANDLERS
+# ==========================================
+async def read_part(part):
+    chunks = []
+    size = 0
+    while True:
+        chunk = await part.read_chunk(READ_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_FILE_BYTES:
+            raise web.HTTPRequestEntityTooLarge(max_size=MAX_FILE_BYTES, actual_size=size)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def extract_upload(service, admission, filename, file_bytes):
+    try:
+        fields, page_sources, line_items = await service.extract(
+            file_bytes, filename.lower().endswith(".pdf"), admission
+        )
+    except ValueError as e:
+        return {"filename": filename, "error": f"Content extraction failed: {e}"}
+    return {"filename": filename, "data": to_response_data(fields, page_sources, line_items)}
+
+
+async def handle_upload(request):
+    service = request.app["service"]
+    if not request.content_type.startswith("multipart/"):
+        return web.json_response({"error": "Expected a multipart/form-data upload"}, status=400)
+
+    uploads = []
+    reader = await request.multipart()
+    async for part in reader:
+        if not part.filename:
+            continue
+        if Path(part.filename).suffix.lower() not in UPLOAD_EXTENSIONS:
+            return web.json_response({"error": f"Unsupported file type: {part.filename}"}, status=415)
+        uploads.append((part.filename, await read_part(part)))
+    if not uploads:
+        return web.json_response({"error": "No file uploaded"}, status=400)
+
+    if len(uploads) > service.capacity:
+        # Would be rejected however idle the server is, so no Retry-After
+        return web.json_response(
+            {"error": f"Too many files in one request (at most {service.capacity})"}, status=413
+        )
+    try:
+        admission = service.admit(len(uploads))
+    except Busy:
+        return web.json_response({"error": "Server busy, retry later"}, status=503, headers={"Retry-After": "5"})
+    tasks = [asyncio.ensure_future(extract_upload(service, admission, name, data)) for name, data in uploads]
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*tasks), timeout=service.timeout)
+    except asyncio.TimeoutError:
+        return web.json_response({"error": "Extraction timed out"}, status=504)
+    finally:
+        # If one document failed, the rest of the batch must not keep its places
+        for task in tasks:
+            task.cancel()
+        admission.release()
+
+    # Single uploads keep the {"data": ...} shape index.html expects
+    if len(results) == 1:
+        result = results[0]
+        status = 422 if "error" in result else 200
+        return web.json_response(result, status=status)
+    return web.json_response({"results": results})
+
+
+async def handle_index(request):
+    return web.FileResponse(INDEX_HTML)
+
+
+async def handle_health(request):
+    service = request.app["service"]
+    return web.json_response({"status": "ok", "inflight": service.inflight, "waiting": service.waiting})
+
+
+async def handle_metrics(request):
+    service = request.app["service"]
+    body = metrics.render_prometheus()
+    body += f"invoice_ocr_inflight_documents {service.inflight}\ninvoice_ocr_waiting_documents {service.waiting}\n"
+    return web.Response(text=body, content_type="text/plain", headers={"X-Prometheus-Format": "0.0.4"})
+
+
+def create_app(workers=None, max_inflight=None, max_queue=64, timeout=120.0):
+    workers = workers or os.cpu_count() or 1
+    app = web.Application(client_max_size=MAX_FILE_BYTES * 4)
+
+    async def start_service(app):
+        app["service"] = ExtractionService(workers, max_inflight or workers * 2, max_queue, timeout)
+        yield
+        await asyncio.get_running_loop().run_in_executor(None, app["service"].close)
+
+    app.cleanup_ctx.append(start_service)
+    app.router.add_get("/", handle_index)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_post("/upload", handle_upload)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP extraction service behind index.html's /upload.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="OCR worker processes (default: CPU count)")
+    parser.add_argument("--max-inflight", type=int, default=None,
+                        help="documents processed concurrently (default: 2x workers)")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="documents allowed to wait for a worker before returning 503")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--metrics", action="store_true", help="record per-stage timings, exposed on /metrics")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        os.environ.setdefault("INVOICE_OCR_METRICS", "1")
+        metrics.enable()
+
+    app = create_app(args.workers, args.max_inflight, args.max_queue, args.timeout)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Grid-search Tesseract and preprocessing settings on a labelled sample folder.
+
+Every sample is OCR'd with each combination of ``--psm``, character whitelist,
+adaptive-threshold parameters and target glyph height. Field accuracy and time
+per page are measured, and for each layout cluster the fastest combination
+whose accuracy reaches ``--min-accuracy`` is saved. Production runs pick those
+settings up via ``INVOICE_OCR_TUNED``:
+
+    python tune.py samples/ -o tuned_ocr.json
+    INVOICE_OCR_TUNED=tuned_ocr.json python run_full_pipeline.py inbox/ -o results.jsonl
+
+The folder holds the invoices plus ``labels.json``, mapping each file name to
+the expected fields (same names as ``extract_fields``)::
+
+    {"amazon_1.jpg": {"Invoice Number": "AMD2-9374", "Total Amount": "₹ 264.10"}}
+"""
+import sys
+import json
+import time
+import argparse
+import itertools
+from pathlib import Path
+
+from benchmark import decode_pages, field_accuracy
+from invoice_ocr.extract import extract_fields
+from invoice_ocr.layout import layout_cluster
+from invoice_ocr.preprocess import (
+    OCR_CONFIG, THRESH_BLOCK_SIZE, THRESH_C, TARGET_TEXT_HEIGHT, ocr_image, preprocess_page, to_gray,
+)
+from invoice_ocr.tuning import save_tuned
+
+WHITELISTS = {
+    "none": None,
+    # Everything invoice fields are made of; keeps Tesseract from reading ₹ as % or rules as letters
+    "invoice": "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,:;-/#()%&@₹$€£|*+",
+}
+
+
+def load_samples(folder, labels_file=None):
+    """[(name, vendor, grayscale pages, expected fields)] for every labelled file."""
+    import numpy as np
+
+    folder = Path(folder)
+    labels = json.loads(Path(labels_file or folder / "labels.json").read_text(encoding="utf-8"))
+    samples = []
+    for name, expected in sorted(labels.items()):
+        path = folder / name
+        if not path.exists():
+            print(f"skipping {name}: file not found", file=sys.stderr)
+            continue
+        # Copy: PDF pages are views into pixmaps that are freed as the generator advances
+        pages = [np.array(to_gray(p)) for p in decode_pages(path.read_bytes(), path.suffix.lower() == ".pdf")]
+        vendor = expected.get("Vendor Name", "unknown")
+        samples.append((name, vendor, pages, expected))
+    return samples
+
+
+def grid(psms, whitelists, thresholds, text_heights):
+    for psm, wl, (block_size, c), text_height in itertools.product(psms, whitelists, thresholds, text_heights):
+        config = f"--oem 3 --psm {psm}"
+        if WHITELISTS[wl]:
+            config += f" -c tessedit_char_whitelist={WHITELISTS[wl]}"
+        yield {"config": config, "block_size": block_size, "c": c, "text_height": text_height}
+
+
+def evaluate(settings, pages, expected):
+    """(fields right, fields labelled, seconds per page) for one sample under one setting."""
+    t0 = time.perf_counter()
+    texts = [ocr_image(preprocess_page(gray, settings), settings["config"]) for gray in pages]
+    elapsed = time.perf_counter() - t0
+    hits, total = field_accuracy(extract_fields("".join(t + "\n\n" for t in texts)), expected)
+    return hits, total, elapsed / len(pages)
+
+
+def choose(results, min_accuracy):
+    """Fastest setting meeting ``min_accuracy``; the most accurate one if none does."""
+    ok = [r for r in results if r["accuracy"] >= min_accuracy]
+    if ok:
+        return min(ok, key=lambda r: r["sec_per_page"])
+    return max(results, key=lambda r: (r["accuracy"], -r["sec_per_page"]))
+
+
+def summarise(per_setting, members):
+    """Aggregate per-sample results of each setting over one group of samples."""
+    rows = []
+    for settings, by_sample in per_setting:
+        hits = sum(by_sample[m][0] for m in members)
+        total = sum(by_sample[m][1] for m in members)
+        rows.append({
+            "settings": settings,
+            "accuracy": round(hits / total, 4) if total else 0.0,
+            "sec_per_page": round(sum(by_sample[m][2] for m in members) / len(members), 4),
+        })
+    return rows
+
+
+def run_tuning(samples, settings_grid, min_accuracy):
+    clusters, vendors = {}, {}
+    for name, vendor, pages, _ in samples:
+        clusters.setdefault(layout_cluster(pages[0]), []).append(name)
+        vendors.setdefault(vendor, []).append(name)
+
+    per_setting = []
+    for settings in settings_grid:
+        by_sample = {name: evaluate(settings, pages, expected) for name, _, pages, expected in samples}
+        per_setting.append((settings, by_sample))
+        print(f"{settings['config'][:24]:<24} thresh={settings['block_size']}:{settings['c']} "
+              f"h={settings['text_height']} done", file=sys.stderr)
+
+    tuned_clusters, report = {}, {"clusters": {}, "vendors": {}}
+    for group, members_by_key in (("clusters", clusters), ("vendors", vendors)):
+        for key, members in sorted(members_by_key.items()):
+            rows = summarise(per_setting, members)
+            best = choose(rows, min_accuracy)
+            report[group][key] = {**best, "samples": len(members), "baseline": rows[0]}
+            if group == "clusters":
+                tuned_clusters[key] = best["settings"]
+    return tuned_clusters, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune OCR settings per layout cluster on labelled invoices.")
+    parser.add_argument("samples", help="folder of invoices with a labels.json")
+    parser.add_argument("--labels", help="labels file (default: SAMPLES/labels.json)")
+    parser.add_argument("--psm", default="6,4,11", help="comma-separated page segmentation modes")
+    parser.add_argument("--whitelist", default="none,invoice", help="comma-separated: " + ", ".join(WHITELISTS))
+    parser.add_argument("--threshold", default=f"{THRESH_BLOCK_SIZE}:{THRESH_C},51:10",
+                        help="comma-separated adaptive threshold BLOCK:C pairs")
+    parser.add_argument("--text-height", default=f"{TARGET_TEXT_HEIGHT},32", help="comma-separated target glyph heights (px)")
+    parser.add_argument("--min-accuracy", type=float, default=0.9, help="field accuracy a setting must reach")
+    parser.add_argument("-o", "--output", default="tuned_ocr.json", help="tuned config file to write")
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.samples, args.labels)
+    if not samples:
+        raise SystemExit("No labelled samples found")
+    settings_grid = list(grid(
+        [int(p) for p in args.psm.split(",")],
+        args.whitelist.split(","),
+        [tuple(int(v) for v in t.split(":")) for t in args.threshold.split(",")],
+        [int(h) for h in args.text_height.split(",")],
+    ))
+    # The current production setting goes first so every group reports it as the baseline
+    default = {"config": OCR_CONFIG, "block_size": THRESH_BLOCK_SIZE, "c": THRESH_C, "text_height": TARGET_TEXT_HEIGHT}
+    settings_grid = [default] + [s for s in settings_grid if s != default]
+
+    clusters, report = run_tuning(samples, settings_grid, args.min_accuracy)
+    save_tuned(args.output, clusters, report["vendors"])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"SAVED_TUNED: {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
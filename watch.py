@@ -0,0 +1,356 @@
+"""Watch-folder daemon: extract invoices as soon as they land in an inbox folder.
+
+    python watch.py inbox/ --out-dir results/ -o results.jsonl
+
+New files are noticed through filesystem events when watchdog is installed
+(inotify on Linux, ReadDirectoryChangesW on Windows). Without watchdog the
+folders are polled instead. A file is processed once it is complete:
+straight away when its writer closes it or renames it into place, otherwise
+once its size and mtime have stopped changing for ``--settle`` seconds.
+The worker pool loads its OCR engines at startup, so each invoice only
+costs its own OCR.
+
+Once its result is written, an invoice is moved into a ``done`` folder
+inside its inbox, or into ``failed`` if it could not be read. The inbox
+then only holds files that were never finished, and a restart picks up
+exactly those. With ``--keep`` files stay where they are, and a restart
+reads them all again unless ``--journal`` records what was done. A file
+that can't be read is tried once more after it has stayed unchanged for
+a few seconds, so a writer that paused for longer than ``--settle`` doesn't
+produce a failure.
+
+Ctrl+C or SIGTERM stops taking new files and lets the invoices already in
+the pool finish and be written. A second signal stops without waiting for
+their results; those files stay in the inbox for the next start.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from invoice_ocr import metrics
+from invoice_ocr.journal import Journal, file_digest
+from invoice_ocr.pipeline import init_worker
+from run_full_pipeline import IMAGE_EXTENSIONS, process_batch_item
+
+SETTLE_SECONDS = 0.5
+POLL_SECONDS = 1.0
+# With events, an occasional full scan still catches anything the OS dropped (queue overflow)
+RESCAN_SECONDS = 30.0
+TICK_SECONDS = 0.05
+# A failed file is read again once it has been unchanged this much longer
+RETRY_SECONDS = 5.0
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+
+
+# ==========================================
+# INBOX
+# ==========================================
+class Inbox:
+    """Tracks files in the watched folders until they are complete and ready to process."""
+
+    def __init__(self, folders, settle=SETTLE_SECONDS, use_events=True):
+        # Absolute, so event paths and scanned paths of the same file compare equal
+        self.folders = [Path(f).resolve() for f in folders]
+        self.settle = settle
+        self.events = queue.Queue()
+        self.waiting = {}  # path -> {"arrived", "sig", "since", "complete"}
+        self.active = {}  # path -> (size, mtime) it had when handed out, until ``finish``
+        self.handled = {}  # path -> (size, mtime) it had when it was finished
+        self.failed = {}  # path -> (size, mtime) of a first failed read
+        self.observer = self._start_observer() if use_events else None
+        self.scan_every = RESCAN_SECONDS if self.observer else POLL_SECONDS
+        self.next_scan = 0.0  # the first poll picks up what is already there
+
+    @property
+    def mode(self):
+        return "events" if self.observer else "polling"
+
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        events = self.events
+
+        class Handler(FileSystemEventHandler):
+            # Runs on the observer thread; the main loop does all the bookkeeping
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                if event.event_type == "moved":
+                    events.put((event.dest_path, True))  # renamed into place: already complete
+                elif event.event_type == "closed":
+                    events.put((event.src_path, True))  # writer closed it
+                elif event.event_type in ("created", "modified"):
+                    events.put((event.src_path, False))
+
+        observer = Observer()
+        for folder in self.folders:
+            observer.schedule(Handler(), str(folder), recursive=False)
+        observer.start()
+        return observer
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def _note(self, path, complete, now):
+        path = Path(path)
+        if path.suffix.lower() not in IMAGE_EXTENSIONS or path.name.startswith(".") or path in self.active:
+            return
+        try:
+            st = path.stat()
+        except OSError:
+            self.waiting.pop(path, None)  # deleted or moved away before it settled
+            return
+        sig = (st.st_size, st.st_mtime_ns)
+        if self.handled.get(path) == sig:
+            return
+        entry = self.waiting.setdefault(path, {"arrived": now, "sig": sig, "since": now, "complete": False})
+        if entry["sig"] != sig:
+            entry.update(sig=sig, since=now, complete=False)
+        if complete:
+            entry["complete"] = True
+
+    def scan(self, now):
+        for folder in self.folders:
+            try:
+                entries = [e.path for e in os.scandir(folder) if e.is_file()]
+            except OSError:
+                continue
+            for path in entries:
+                self._note(path, False, now)
+            # Forget files that left the folder so the bookkeeping doesn't grow forever
+            present = {Path(p) for p in entries}
+            for seen in (self.handled, self.failed):
+                for path in [p for p in seen if p.parent == folder and p not in present]:
+                    del seen[path]
+
+    def poll(self, timeout):
+        """Wait up to ``timeout`` for activity; return [(path, arrival time)] of files now complete."""
+        try:
+            item = self.events.get(timeout=timeout)
+            while True:
+                self._note(*item, time.monotonic())
+                item = self.events.get_nowait()
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        if now >= self.next_scan:
+            self.scan(now)
+            self.next_scan = now + self.scan_every
+
+        ready = []
+        for path, entry in list(self.waiting.items()):
+            if not entry["complete"]:
+                if now - entry["since"] < self.settle:
+                    continue
+                self._note(path, False, now)  # re-stat: still unchanged?
+                entry = self.waiting.get(path)
+                if entry is None or now - entry["since"] < self.settle:
+                    continue
+            del self.waiting[path]
+            self.active[path] = entry["sig"]
+            ready.append((path, entry["arrived"]))
+        return ready
+
+    def finish(self, path, ok):
+        """Done with a file ``poll`` handed out; returns True if it will be read again.
+
+        A file that failed is read once more after ``RETRY_SECONDS`` without
+        changes, in case its writer had only paused, and its failure should be
+        dropped. Only the same content failing twice counts as failed.
+        """
+        sig = self.active.pop(path)
+        if not ok:
+            try:
+                st = path.stat()
+            except OSError:
+                return False
+            if self.failed.pop(path, None) != sig or (st.st_size, st.st_mtime_ns) != sig:
+                self.failed[path] = sig
+                now = time.monotonic()
+                self._note(path, False, now)
+                entry = self.waiting.get(path)
+                if entry is not None and entry["sig"] == sig:
+                    entry["since"] = now + RETRY_SECONDS
+                return True
+        self.failed.pop(path, None)
+        self.handled[path] = sig
+        return False
+
+
+# ==========================================
+# DAEMON
+# ==========================================
+def init_daemon_worker():
+    # Ctrl+C reaches the whole process group; the parent decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker()
+
+
+def write_result_file(out_dir, result):
+    """Write ``invoice_output_<name>.json`` like single-file mode, atomically for readers polling the folder."""
+    target = out_dir / f"invoice_output_{Path(result['file']).stem}.json"
+    tmp = target.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp, target)
+    return target
+
+
+def archive(path, folder):
+    """Move an inbox file into ``folder`` next to it, without overwriting an earlier file of that name."""
+    target_dir = path.parent / folder
+    target_dir.mkdir(exist_ok=True)
+    target = target_dir / path.name
+    n = 1
+    while target.exists():
+        target = target_dir / f"{path.stem}.{n}{path.suffix}"
+        n += 1
+    try:
+        os.replace(path, target)
+    except OSError as e:
+        print(f"WARNING: could not move {path} to {target_dir}: {e}", file=sys.stderr)
+
+
+def run_daemon(inbox, pool, workers, out, out_dir=None, journal=None, stop=None, keep=False):
+    """Feed completed inbox files to the pool and write each result as it finishes.
+
+    Returns (processed, failed) once ``stop`` is set and the in-flight invoices are written.
+    """
+    stop = stop or threading.Event()
+    # Files not yet in the pool stay here, so a shutdown only waits for a short window
+    backlog = deque()
+    max_pending = workers * 2
+    pending = {}
+    processed = failed = 0
+
+    while True:
+        if not stop.is_set():
+            for path, arrived in inbox.poll(TICK_SECONDS if not pending else 0):
+                backlog.append((path, arrived))
+        while backlog and len(pending) < max_pending and not stop.is_set():
+            path, arrived = backlog.popleft()
+            digest = None
+            if journal is not None:
+                try:
+                    digest = file_digest(path)
+                except OSError:
+                    inbox.finish(path, False)  # gone again already
+                    continue
+                if journal.has(digest):
+                    inbox.finish(path, True)
+                    if not keep:
+                        archive(path, DONE_DIR)
+                    continue
+            pending[pool.submit(process_batch_item, path)] = (path, arrived, digest)
+        if not pending:
+            if stop.is_set():
+                break
+            continue
+
+        done, _ = wait(pending, timeout=TICK_SECONDS, return_when=FIRST_COMPLETED)
+        for fut in done:
+            path, arrived, digest = pending.pop(fut)
+            result = fut.result()
+            result.pop("_page_sources", None)
+            snap = result.pop("_metrics", None)
+            if snap is not None:
+                metrics.merge(snap)
+            ok = "error" not in result
+            if inbox.finish(path, ok):
+                print(f"RETRY: {result['file']} failed ({result['error']}), reading it again once it is unchanged",
+                      file=sys.stderr)
+                continue
+            processed += 1
+            if not ok:
+                failed += 1
+            elif journal is not None and digest is not None:
+                journal.record(digest, result["file"], result)
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            if out_dir is not None:
+                print(f"SAVED_JSON: {write_result_file(out_dir, result).resolve()}", file=sys.stderr)
+            # Only after the result is written: a crash in between reads the file again
+            if not keep:
+                archive(path, DONE_DIR if ok else FAILED_DIR)
+            print(f"DONE: {result['file']} in {time.monotonic() - arrived:.2f}s", file=sys.stderr)
+    return processed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch inbox folders and extract invoices as they arrive.")
+    parser.add_argument("folders", nargs="+", help="inbox folders to watch")
+    parser.add_argument("-o", "--output", help="append results as JSON lines to this file instead of stdout")
+    parser.add_argument("--out-dir", help="also write invoice_output_<name>.json per invoice into this folder")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="OCR worker processes (default: CPU count)")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help="seconds a file's size must stay unchanged before it counts as fully written")
+    parser.add_argument("--poll", action="store_true", help="poll the folders even if watchdog is installed")
+    parser.add_argument("--keep", action="store_true",
+                        help=f"leave invoices in the inbox instead of moving them into {DONE_DIR}/ or {FAILED_DIR}/")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="SQLite checkpoint journal; invoices already recorded there (by content hash) are skipped")
+    args = parser.parse_args(argv)
+
+    folders = [Path(f) for f in args.folders]
+    for folder in folders:
+        if not folder.is_dir():
+            raise SystemExit(f"Not a folder: {folder}")
+    out_dir = Path(args.out_dir) if args.out_dir else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    workers = args.workers or os.cpu_count() or 1
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print("DRAINING: finishing invoices in progress (signal again to exit now)", file=sys.stderr)
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_stop)
+
+    journal = Journal(args.journal) if args.journal else None
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_daemon_worker)
+    inbox = None
+    drain = True
+    try:
+        # Start every worker and load its engine now rather than on the first invoice
+        wait([pool.submit(os.getpid) for _ in range(workers)])
+        inbox = Inbox(folders, args.settle, use_events=not args.poll)
+        print(f"WATCHING: {', '.join(str(f) for f in folders)} ({inbox.mode}, {workers} workers)", file=sys.stderr)
+        processed, failed = run_daemon(inbox, pool, workers, out, out_dir, journal, stop, args.keep)
+        print(f"PROCESSED: {processed} FAILED: {failed}", file=sys.stderr)
+    except KeyboardInterrupt:
+        drain = False
+        raise
+    finally:
+        if inbox is not None:
+            inbox.stop()
+        pool.shutdown(wait=drain, cancel_futures=not drain)
+        if journal is not None:
+            journal.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()